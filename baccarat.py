@@ -5,12 +5,20 @@ Simulator for online live dealer baccarat at the Golden Nugget
 """
 
 from __future__ import division
+import collections
+import functools
+import os
 import random
 
+import numpy as np
+
+import runner
+
 TIE = 0
 PLAYER_WIN = 1
 BANKER_WIN = 2
 NUMBER_OF_SIMULATIONS = 100
+USE_OUTCOME_TABLE = False  # Look hands up in a precomputed table instead of playing them out
 
 def check_winner(player_sum, banker_sum):
     if player_sum > banker_sum:
@@ -19,71 +27,97 @@ def check_winner(player_sum, banker_sum):
         return BANKER_WIN
     return TIE
 
-def play_shoe():
+#value of each blackjack.py card code (suit * 13 + rank), for shoes from a
+#shoelib library
+CARD_VALUES = np.tile(np.array([1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10], dtype=np.uint8), 4)
+
+def shuffle_cards(bdeck, rng=None):
+    #rng is a numpy Generator for this shoe (see runner.get_shoe_rng), None
+    #shuffles with the random module
+    if rng is None:
+        random.shuffle(bdeck)
+        return bdeck
+    bdeck = np.array(bdeck, dtype=np.uint8)
+    rng.shuffle(bdeck)
+    return bdeck.tolist()
+
+def get_shoe(decks, rng=None, cards=None):
+    #card values in dealing order: shuffled with rng, or the shoelib card
+    #codes in cards
+    if cards is not None:
+        return CARD_VALUES[cards].tolist()
     suit = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10]
     deck = suit + suit + suit + suit
-    bdeck = deck + deck + deck + deck + deck + deck + deck + deck
-    random.shuffle(bdeck)
+    return shuffle_cards(deck * decks, rng)
+
+def play_hand(bdeck, pos):
+    #Plays the hand starting at bdeck[pos]. Returns the winner and the
+    #position of the next hand
+    #cards are dealt alternately, player first
+    player = [bdeck[pos], bdeck[pos + 2]]
+    banker = [bdeck[pos + 1], bdeck[pos + 3]]
+    idx = pos + 4
+    player_sum = sum(player) % 10
+    banker_sum = sum(banker) % 10
+    banker_cards = 2
+    player_cards = 2
+    #If either the player or the bank have a total of 8 or 9 on the first two cards no further cards are drawn
+    #(iow, skip to checking winner)
+    if (player_sum < 8 and banker_sum < 8):
+        if player_sum <= 5:
+            #player draws a third card
+            player_cards += 1
+            player_third_card = bdeck[idx] % 10
+            player_sum = (player_sum + player_third_card) % 10
+            
+            idx += 1
+            #If the player does take a third card then the Bank's third-card-rule below will determine if the bank takes a third card.
+            #If the bank's total is 2 or less then bank draws a card, regardless of what the players third card is.
+            #If the banks total is 3 then the bank draws a third card unless the players third card was an 8.
+            #If the banks total is 4 then the bank draws a third card unless the players third card was a 0, 1, 8, or 9.
+            #If the banks total is 5 then the bank draws a third card if the players third card was 4, 5, 6, or 7.
+            #If the banks total is 6 then the bank draws a third card if the players third card was a 6 or 7.
+            #If the banks total is 7 then the bank stands.
+            if banker_sum <= 2:
+                banker_sum = (banker_sum + bdeck[idx]) % 10
+                idx += 1
+                banker_cards += 1
+            elif banker_sum == 3 and not player_third_card == 8:
+                banker_sum = (banker_sum + bdeck[idx]) % 10
+                idx += 1
+                banker_cards += 1
+            elif banker_sum == 4 and not (player_third_card == 0 or player_third_card == 1 or player_third_card == 8 or player_third_card == 9):
+                banker_sum = (banker_sum + bdeck[idx]) % 10
+                idx += 1
+                banker_cards += 1
+            elif banker_sum == 5 and (player_third_card == 4 or player_third_card == 5 or player_third_card == 6 or player_third_card == 7):
+                banker_sum = (banker_sum + bdeck[idx]) % 10
+                idx += 1
+                banker_cards += 1
+            elif banker_sum == 6 and (player_third_card == 6 or player_third_card == 7):
+                banker_sum = (banker_sum + bdeck[idx]) % 10
+                idx += 1
+                banker_cards += 1
+        else:
+            #player does not draw a third card
+            if banker_sum < 6:
+                #bank takes a third card
+                banker_sum = (banker_sum + bdeck[idx]) % 10
+                idx += 1
+                banker_cards += 1
+            #else:
+                #bank does not take a third card, done
+    return check_winner(player_sum, banker_sum), idx
+
+def play_shoe(decks=8, card_limit=24, rng=None, cards=None):
+    bdeck = get_shoe(decks, rng, cards)
     player_win_count = 0
     banker_win_count = 0
     tie_count = 0
 
-    card_limit = 24
-    while len(bdeck) > card_limit:
-        player = bdeck[0:1]
-        banker = bdeck[2:3]
-        idx = 4
-        player_sum = sum(player) % 10
-        banker_sum = sum(banker) % 10
-        banker_cards = 2
-        player_cards = 2
-        #If either the player or the bank have a total of 8 or 9 on the first two cards no further cards are drawn
-        #(iow, skip to checking winner)
-        if (player_sum < 8 and banker_sum < 8):
-            if player_sum <= 5:
-                #player draws a third card
-                player_cards += 1
-                player_third_card = bdeck[idx]
-                player_sum = (player_sum + player_third_card) % 10
-            
-                idx += 1
-                #If the player does take a third card then the Bank's third-card-rule below will determine if the bank takes a third card.
-                #If the bank's total is 2 or less then bank draws a card, regardless of what the players third card is.
-                #If the banks total is 3 then the bank draws a third card unless the players third card was an 8.
-                #If the banks total is 4 then the bank draws a third card unless the players third card was a 0, 1, 8, or 9.
-                #If the banks total is 5 then the bank draws a third card if the players third card was 4, 5, 6, or 7.
-                #If the banks total is 6 then the bank draws a third card if the players third card was a 6 or 7.
-                #If the banks total is 7 then the bank stands.
-                if banker_sum <= 2:
-                    banker_sum = (banker_sum + bdeck[idx]) % 10
-                    idx += 1
-                    banker_cards += 1
-                elif banker_sum == 3 and not player_third_card == 8:
-                    banker_sum = (banker_sum + bdeck[idx]) % 10
-                    idx += 1
-                    banker_cards += 1
-                elif banker_sum == 4 and not (player_third_card == 0 or player_third_card == 1 or player_third_card == 8 or player_third_card == 9):
-                    banker_sum = (banker_sum + bdeck[idx]) % 10
-                    idx += 1
-                    banker_cards += 1
-                elif banker_sum == 5 and (player_third_card == 4 or player_third_card == 5 or player_third_card == 6 or player_third_card == 7):
-                    banker_sum = (banker_sum + bdeck[idx]) % 10
-                    idx += 1
-                    banker_cards += 1
-                elif banker_sum == 6 and (player_third_card == 6 or player_third_card == 7):
-                    banker_sum = (banker_sum + bdeck[idx]) % 10
-                    idx += 1
-                    banker_cards += 1
-            else:
-                #player does not draw a third card
-                if banker_sum < 6:
-                    #bank takes a third card
-                    banker_sum = (banker_sum + bdeck[idx]) % 10
-                    idx += 1
-                    banker_cards += 1
-                #else:
-                    #bank does not take a third card, done
-        winner = check_winner(player_sum, banker_sum, player_cards, banker_cards)
+    pos = 0
+    while len(bdeck) - pos > card_limit:
+        winner, pos = play_hand(bdeck, pos)
         if winner == PLAYER_WIN:
             #player wins
             player_win_count += 1
@@ -94,8 +128,6 @@ def play_shoe():
             #however, the the tie count cannot increase because tie would mean player ties too.. hmm...
         else:
             tie_count += 1
-        #print 'index: ', idx
-        bdeck = bdeck[idx:]
 
     #print 'done'
     #print "Player wins: ", player_win_count
@@ -103,18 +135,211 @@ def play_shoe():
     #print "Ties: ", tie_count
     return [player_win_count, banker_win_count, tie_count]
 
+#BANKER_DRAWS[banker_sum][player_third_card], same third-card rule as play_shoe
+BANKER_DRAWS = np.zeros((10, 10), dtype=bool)
+BANKER_DRAWS[0:3, :] = True
+BANKER_DRAWS[3, :] = True
+BANKER_DRAWS[3, 8] = False
+BANKER_DRAWS[4, 2:8] = True
+BANKER_DRAWS[5, 4:8] = True
+BANKER_DRAWS[6, 6:8] = True
+
+def play_hands(cards):
+    #cards is an (n, 6) array of the next six card values mod 10 for n hands.
+    #Returns each hand's winner (TIE, PLAYER_WIN, BANKER_WIN) and the number
+    #of cards it used
+    player_sum = (cards[:, 0] + cards[:, 2]) % 10
+    banker_sum = (cards[:, 1] + cards[:, 3]) % 10
+    natural = (player_sum >= 8) | (banker_sum >= 8)
+
+    player_draws = ~natural & (player_sum <= 5)
+    player_third_card = cards[:, 4]
+    player_sum = np.where(player_draws, (player_sum + player_third_card) % 10, player_sum)
+
+    #bank stands on 6+ if the player stood, otherwise follows the third-card rule
+    banker_draws = ~natural & np.where(player_draws, BANKER_DRAWS[banker_sum, player_third_card], banker_sum <= 5)
+    banker_third_card = np.where(player_draws, cards[:, 5], cards[:, 4])
+    banker_sum = np.where(banker_draws, (banker_sum + banker_third_card) % 10, banker_sum)
+
+    winner = np.where(player_sum > banker_sum, PLAYER_WIN, np.where(banker_sum > player_sum, BANKER_WIN, TIE))
+    return winner, 4 + player_draws + banker_draws
+
+#position of each winner in play_shoe()'s [player, banker, tie] result
+WINNER_COLUMNS = [2, 0, 1]
 
+def play_shoes(n_shoes, decks=8, card_limit=24, seed=None, first_shoe=0):
+    #Plays shoes first_shoe to first_shoe + n_shoes of a seed run in lock-step,
+    #one hand per shoe per pass. Returns an (n_shoes, 3) array of player,
+    #banker, tie counts, one row per shoe like play_shoe() with the same shoe's rng
+    suit = np.array([1, 2, 3, 4, 5, 6, 7, 8, 9, 0, 0, 0, 0], dtype=np.uint8)
+    shoes = runner.shuffle_shoes(np.tile(suit, 4 * decks), n_shoes, runner.get_master_seed(seed), first_shoe)
+    return play_shuffled_shoes(shoes, card_limit)
 
-#player, banker, tie
-running_total = [0, 0, 0]
-running_average = [0, 0, 0]
+def play_library_shoes(library, card_limit=24):
+    #play_shoes() for shoelib card codes, such as a slice of a library memmap
+    return play_shuffled_shoes(CARD_VALUES[library] % 10, card_limit)
 
-for i in range(1, NUMBER_OF_SIMULATIONS):
-    winner_counts = play_shoe()
-    total = sum(winner_counts)
-    for j in range(0,3):
-        running_total[j] = running_total[j] + winner_counts[j]
+def play_shuffled_shoes(shoes, card_limit=24):
+    #shoes is an (n_shoes, cards) array of card values mod 10 in dealing order
+    n_shoes = len(shoes)
+    counts = np.zeros((n_shoes, 3), dtype=np.int64)
+    cursor = np.zeros(n_shoes, dtype=np.intp)
+    rows = np.arange(n_shoes)
+    window = np.arange(6)
+    columns = np.array(WINNER_COLUMNS)
+    active = rows
+    while len(active) > 0:
+        pos = cursor[active]
+        winner, used = play_hands(shoes[active[:, None], pos[:, None] + window])
+        counts[active, columns[winner]] += 1
+        cursor[active] = pos + used
+        active = rows[shoes.shape[1] - cursor > card_limit]
+    return counts
+
+#outcome of every possible six-card window, cached next to this file
+OUTCOME_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baccarat_outcomes_v1.npy')
+outcome_table = None
+
+def build_outcome_table():
+    #entry for key d0*10^5 + ... + d5 (the next six card values) is
+    #cards_used << 2 | winner
+    keys = np.arange(10 ** 6)
+    cards = np.stack([keys // 10 ** (5 - k) % 10 for k in range(0, 6)], axis=1)
+    winner, used = play_hands(cards)
+    return ((used << 2) | winner).astype(np.uint8)
+
+def get_outcome_table():
+    global outcome_table
+    if outcome_table is None:
+        try:
+            outcome_table = np.load(OUTCOME_TABLE_PATH)
+            if outcome_table.shape != (10 ** 6,) or outcome_table.dtype != np.uint8:
+                raise ValueError('stale outcome table')
+        except (OSError, ValueError):
+            outcome_table = build_outcome_table()
+            try:
+                #write under a temporary name first so workers never load half a file
+                temp_path = OUTCOME_TABLE_PATH + '.' + str(os.getpid()) + '.npy'
+                np.save(temp_path, outcome_table)
+                os.replace(temp_path, OUTCOME_TABLE_PATH)
+            except OSError:
+                pass
+    return outcome_table
+
+def play_shoe_table(decks=8, card_limit=24, rng=None, cards=None):
+    #Same as play_shoe, but each hand is a single outcome table lookup
+    bdeck = get_shoe(decks, rng, cards)
+    values = np.array(bdeck) % 10
+    windows = len(values) - 5
+    keys = sum(values[k:windows + k] * 10 ** (5 - k) for k in range(0, 6))
+    outcomes = get_outcome_table()[keys].tolist()
+    counts = [0, 0, 0]
+
+    pos = 0
+    while len(bdeck) - pos > card_limit:
+        outcome = outcomes[pos]
+        counts[WINNER_COLUMNS[outcome & 3]] += 1
+        pos += outcome >> 2
+    return counts
+
+
+#exact odds from a shoe composition: every six-card window is weighted by the
+#chance of drawing it in that order, which also averages out the cards a hand
+#doesn't use. That chance only depends on how many of each value the window
+#holds, so the 10^6 windows are grouped into the 5005 multisets of six values,
+#each with its count of windows won by player, banker and tie
+multiset_values = None
+multiset_wins = None
+
+def full_shoe_composition(decks=8):
+    #count of each card value 0-9
+    return [16 * decks] + [4 * decks] * 9
+
+def get_multiset_arrays():
+    global multiset_values, multiset_wins
+    if multiset_values is None:
+        keys = np.arange(10 ** 6)
+        digits = np.stack([keys // 10 ** (5 - k) % 10 for k in range(0, 6)], axis=1)
+        #how many of each value every window holds, packed base 7 to group them
+        values = np.zeros((10 ** 6, 10), dtype=np.int64)
+        for k in range(0, 6):
+            values[keys, digits[:, k]] += 1
+        codes, first, inverse = np.unique(values @ 7 ** np.arange(10), return_index=True, return_inverse=True)
+        multiset_values = values[first]
+        winner = get_outcome_table() & 3
+        multiset_wins = np.bincount(inverse * 3 + winner, minlength=3 * len(codes)).reshape(-1, 3).astype(np.float64)
+    return multiset_values, multiset_wins
+
+@functools.lru_cache(maxsize=4096)
+def get_cached_odds(composition):
+    values, wins = get_multiset_arrays()
+    counts = np.array(composition, dtype=np.float64)
+    #falling[v, m] = counts[v] * (counts[v] - 1) * ... m terms, the ways to
+    #draw m cards of value v in order (0 once the shoe runs out of them)
+    falling = np.ones((10, 7))
+    for m in range(1, 7):
+        falling[:, m] = falling[:, m - 1] * np.maximum(counts - (m - 1), 0.0)
+    cards = counts.sum()
+    probability = falling[np.arange(10), values].prod(axis=1) / np.prod(cards - np.arange(6))
+    by_winner = probability @ wins
+    return float(by_winner[PLAYER_WIN]), float(by_winner[BANKER_WIN]), float(by_winner[TIE])
+
+def get_exact_odds(composition):
+    #composition is the count of each card value 0-9 left in the shoe (at least
+    #six cards). Returns exact player, banker, tie probabilities for the next hand
+    if sum(composition) < 6:
+        raise ValueError('need at least six cards to play a hand')
+    return get_cached_odds(tuple(int(n) for n in composition))
+
+
+
+#totals over every shoe of a simulate() run
+SimulationResult = collections.namedtuple('SimulationResult', ['shoes', 'hands', 'player_wins', 'banker_wins', 'ties'])
+
+def simulate(n_shoes, decks=8, cut_card=24, seed=None, engine='scalar', workers=1, chunk_size=None, library=None):
+    #cut_card is the number of cards left when the shoe is reshuffled.
+    #engine is 'scalar' (play_shoe), 'table' (play_shoe_table) or 'batch'
+    #(play_shoes, always in this process). Runs in this process by default,
+    #pass workers to fan the shoes out with runner.run_shoes. library plays
+    #the first n_shoes shoes of a shoelib file instead of shuffling (decks
+    #and seed then come from the library)
+    if cut_card < 5:
+        raise ValueError('cut_card must be at least 5, a hand can need six cards')
+    if engine == 'batch':
+        if library is not None:
+            import shoelib
+            counts = play_library_shoes(shoelib.get_library(library)[:n_shoes], cut_card)
+        else:
+            counts = play_shoes(n_shoes, decks, cut_card, seed)
+        totals = counts.sum(axis=0).tolist()
+    else:
+        if engine == 'scalar':
+            play = functools.partial(play_shoe, decks, cut_card)
+        elif engine == 'table':
+            play = functools.partial(play_shoe_table, decks, cut_card)
+        else:
+            raise ValueError('unknown engine: ' + str(engine))
+        totals = [0, 0, 0]
+        if library is not None:
+            results = runner.run_library(play, library, n_shoes, workers, chunk_size)
+        else:
+            results = runner.run_shoes(play, n_shoes, workers, seed, chunk_size)
+        for winner_counts in results:
+            for j in range(0,3):
+                totals[j] += winner_counts[j]
+    return SimulationResult(n_shoes, sum(totals), totals[0], totals[1], totals[2])
+
+def main(workers=None, seed=None, chunk_size=None):
+    engine = 'table' if USE_OUTCOME_TABLE else 'scalar'
+    result = simulate(NUMBER_OF_SIMULATIONS, seed=seed, engine=engine, workers=workers, chunk_size=chunk_size)
+
+    #player, banker, tie
+    running_total = [result.player_wins, result.banker_wins, result.ties]
+    running_average = [0, 0, 0]
     for j in range(0, 3):
-        running_average[j] = (running_total[j] / sum(running_total)) * 100
+        running_average[j] = (running_total[j] / result.hands) * 100
+
+    print("Games: " + str(result.shoes) + " -- Player " + str(running_average[0]) + " -- Banker " + str(running_average[1]) + " -- Tie " + str(running_average[2]))
 
-print("Games: " + str(NUMBER_OF_SIMULATIONS) + " -- Player " + str(running_average[0]) + " -- Banker " + str(running_average[1]) + " -- Tie " + str(running_average[2]))
+if __name__=='__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+bankroll.py
+
+Bootstrapped bankroll paths, risk of ruin and drawdowns from per-round outcomes
+"""
+
+import collections
+import sys
+
+import numpy as np
+
+import blackjack
+import runner
+
+# Outcomes come in as an (n_shoes, rounds) array in units of one base bet,
+# each shoe's rounds in order and padded with 0. Paths are strung together
+# from shoes drawn with replacement, so the count's pull on bets within a
+# shoe is kept. A path in bet units is the same for every bankroll and bet,
+# so a whole grid is read off one set of paths by comparing it against
+# bankroll / bet.
+
+SHOES_PER_BATCH = 1 << 22  # Path shoes held in memory at once
+
+BankrollResult = collections.namedtuple('BankrollResult', ['bankroll', 'bet', 'risk_of_ruin', 'double_chance',
+                                                           'median_shoes_to_double', 'median_drawdown',
+                                                           'drawdown_95'])
+
+def get_log_outcomes(path, bet_unit=None):
+    # Outcomes from an eventlog round log, side bets included, in units of
+    # bet_unit (default NORMAL_BET_AMOUNT)
+    import eventlog
+    if bet_unit is None:
+        bet_unit = blackjack.NORMAL_BET_AMOUNT
+    rounds = eventlog.read_rounds(path)
+    shoes = rounds['shoe'].astype(np.intp)
+    shoes -= shoes.min()
+    outcomes = np.zeros((shoes.max() + 1, int(rounds['round'].max()) + 1), dtype=np.float32)
+    outcomes[shoes, rounds['round']] = (rounds['outcome'] + rounds['pp_outcome'] + rounds['plus3_outcome']) / bet_unit
+    return outcomes
+
+def get_batch_outcomes(n_shoes, seed=None, config=None):
+    # Outcomes of n_shoes shoes of a seed run, side bets included, from the
+    # batch engine
+    import blackjack_batch
+    if config is None:
+        config = blackjack.get_config()
+    shoes = runner.shuffle_shoes(blackjack.fill_shoe(config.decks_per_shoe).cards, n_shoes, runner.get_master_seed(seed))
+    return blackjack_batch.get_round_outcomes(shoes, config._replace(normal_bet_amount=1)).astype(np.float32)
+
+def count_below(running, levels):
+    # For each row of running, non-decreasing along axis 1, how many entries
+    # are below each level: a (len(levels), rows) array. Rows are shifted
+    # apart so one searchsorted over the flattened array answers them all.
+    rows, columns = running.shape
+    low = min(running.min(), levels.min())
+    width = max(running.max(), levels.max()) - low + 1.0
+    offsets = np.arange(rows) * width
+    flat = (running - low + offsets[:, None]).reshape(-1)
+    found = np.searchsorted(flat, levels[:, None] - low + offsets, side='left')
+    return found - np.arange(rows) * columns
+
+def simulate_paths(outcomes, ratios, n_paths, shoes_per_path, seed=None):
+    # Bootstraps n_paths paths of shoes_per_path shoes. For each bankroll in
+    # bet units in ratios, returns (ruined, shoes to double, drawdowns) per
+    # path: whether the path lost the bankroll, the shoe it first doubled it
+    # in before any ruin (0 if it never did), and its max drawdown in bet
+    # units up to the round it was ruined in, if it was.
+    #
+    # A shoe's own total, lowest and highest point and largest drawdown are
+    # worked out once, so paths are followed a shoe at a time. Only the shoe
+    # a path is ruined in is replayed round by round.
+    rng = np.random.default_rng(runner.get_master_seed(seed))
+    ratios = np.asarray(ratios, dtype=np.float64)
+    shoe_paths = np.cumsum(outcomes, axis=1, dtype=np.float32)  # Whole and half bets, so float32 sums are exact
+    shoe_totals = shoe_paths[:, -1]
+    shoe_lows = shoe_paths.min(axis=1)
+    shoe_highs = shoe_paths.max(axis=1)
+    shoe_drawdowns = (np.maximum(np.maximum.accumulate(shoe_paths, axis=1), 0.0) - shoe_paths).max(axis=1)
+    ruined = np.zeros((len(ratios), n_paths), dtype=bool)
+    shoes_to_double = np.zeros((len(ratios), n_paths), dtype=np.int64)
+    drawdowns = np.zeros((len(ratios), n_paths), dtype=np.float32)
+    batch_paths = max(1, SHOES_PER_BATCH // shoes_per_path)
+    for start in range(0, n_paths, batch_paths):
+        stop = min(n_paths, start + batch_paths)
+        picks = rng.integers(0, len(outcomes), (stop - start, shoes_per_path))
+        totals = shoe_totals[picks]
+        starts = np.cumsum(totals, axis=1) - totals  # Bankroll when each shoe begins
+        shoe_lows_here = starts + shoe_lows[picks]
+        lows = np.minimum.accumulate(shoe_lows_here, axis=1)
+        highs = np.maximum(np.maximum.accumulate(starts + shoe_highs[picks], axis=1), 0.0)
+        previous_highs = np.zeros_like(highs)
+        previous_highs[:, 1:] = highs[:, :-1]
+        path_drawdowns = np.maximum.accumulate(np.maximum(previous_highs - shoe_lows_here, shoe_drawdowns[picks]), axis=1)
+        # The shoe each path is ruined or doubles in, shoes_per_path if never
+        ruin_shoes = count_below(-lows, ratios)
+        double_shoes = count_below(highs, ratios)
+        for i, ratio in enumerate(ratios):
+            ruin_shoe = ruin_shoes[i]
+            double_shoe = double_shoes[i]
+            doubled = double_shoe < ruin_shoe
+            path_drawdown = path_drawdowns[:, -1].copy()
+            hit = np.flatnonzero(ruin_shoe < shoes_per_path)
+            if len(hit):
+                # Replay the ruining shoe: where the ruin came, the drawdown up
+                # to it, and whether a double in the same shoe came first
+                shoe = ruin_shoe[hit]
+                values = starts[hit, shoe][:, None] + shoe_paths[picks[hit, shoe]]
+                ruin_step = (np.minimum.accumulate(values, axis=1) > -ratio).sum(axis=1)
+                running_highs = np.maximum(np.maximum.accumulate(values, axis=1), previous_highs[hit, shoe][:, None])
+                played = np.arange(values.shape[1]) <= ruin_step[:, None]
+                shoe_drawdown = np.where(played, running_highs - values, 0.0).max(axis=1)
+                earlier = np.where(shoe > 0, path_drawdowns[hit, np.maximum(shoe - 1, 0)], 0.0)
+                path_drawdown[hit] = np.maximum(earlier, shoe_drawdown)
+                same = double_shoe[hit] == shoe
+                doubled[hit[same]] = (running_highs[same] < ratio).sum(axis=1) < ruin_step[same]
+            ruined[i, start:stop] = ruin_shoe < shoes_per_path
+            shoes_to_double[i, start:stop] = np.where(doubled, double_shoe + 1, 0)
+            drawdowns[i, start:stop] = path_drawdown
+    return ruined, shoes_to_double, drawdowns
+
+def evaluate_grid(outcomes, bankrolls, bets, n_paths=100000, shoes_per_path=1000, seed=None):
+    # A BankrollResult for every bankroll and bet, over a horizon of
+    # shoes_per_path shoes. Drawdowns are in money, and stop where a path is
+    # ruined, so they're never much more than the bankroll plus its peak.
+    grid = [(bankroll, bet) for bankroll in bankrolls for bet in bets]
+    ratios = sorted(set(bankroll / bet for bankroll, bet in grid))
+    ruined, shoes_to_double, drawdowns = simulate_paths(outcomes, ratios, n_paths, shoes_per_path, seed)
+    results = []
+    for bankroll, bet in grid:
+        i = ratios.index(bankroll / bet)
+        doubled = shoes_to_double[i][shoes_to_double[i] > 0]
+        median_drawdown, drawdown_95 = np.percentile(drawdowns[i], [50, 95]).tolist()
+        results.append(BankrollResult(bankroll, bet, ruined[i].mean(), len(doubled) / n_paths,
+                                      float(np.median(doubled)) if len(doubled) else float('inf'),
+                                      median_drawdown * bet, drawdown_95 * bet))
+    return results
+
+def parse_values(text):
+    return [float(value) for value in text.split(',')]
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Risk of ruin and drawdowns for a grid of bankrolls and bets')
+    parser.add_argument('--log', metavar='PATH', help='take round outcomes from an eventlog round log')
+    parser.add_argument('--shoes', type=int, default=10000, help='without --log, shoes to play with the batch engine')
+    parser.add_argument('--seed', type=int, help='master seed for the shoes and the bootstrap')
+    parser.add_argument('--bankrolls', type=parse_values, default=[blackjack.STARTING_BANKROLL], metavar='B1,B2')
+    parser.add_argument('--bets', type=parse_values, default=[blackjack.NORMAL_BET_AMOUNT], metavar='B1,B2')
+    parser.add_argument('--paths', type=int, default=100000, help='bankroll paths to bootstrap')
+    parser.add_argument('--horizon', type=int, default=1000, help='shoes per path')
+    args = parser.parse_args(argv)
+
+    seed = runner.get_master_seed(args.seed)
+    if args.log:
+        outcomes = get_log_outcomes(args.log)
+    else:
+        outcomes = get_batch_outcomes(args.shoes, seed)
+    print('Seed = ' + str(seed))
+    print('Shoes sampled = ' + str(len(outcomes)) + ', paths = ' + str(args.paths) + ' of ' + str(args.horizon) + ' shoes')
+    print('\t'.join(['Bankroll', 'Bet', 'Risk of ruin', 'Doubled', 'Median shoes to double', 'Median drawdown',
+                     '95% drawdown']))
+    for result in evaluate_grid(outcomes, args.bankrolls, args.bets, args.paths, args.horizon, seed):
+        print('\t'.join([str(result.bankroll), str(result.bet), str(round(result.risk_of_ruin, 4)),
+                         str(round(result.double_chance, 4)), str(result.median_shoes_to_double),
+                         str(round(result.median_drawdown, 2)), str(round(result.drawdown_95, 2))]))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,245 @@
+"""
+bench.py
+
+Fixed-seed benchmarks of the blackjack and baccarat hot paths, saved as JSON
+so runs on different commits can be compared
+"""
+
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import timeit
+
+import numpy as np
+
+import baccarat
+import blackjack
+import blackjack_batch
+import runner
+
+SEED = 2024  # Every benchmark plays the same cards on every run
+REPEAT = 5
+MIN_SECONDS = 0.2  # Each repeat runs the benchmark at least this long
+DECK_SIZES = [1, 2, 6, 8]
+BATCH_SHOES = 200
+
+# Each benchmark is a setup function returning (run, ops): run() is timed and
+# does ops operations, so results are per operation (a card, a decision, a
+# round or a shoe) and comparable whatever the loop sizes.
+benchmarks = {}
+
+def benchmark(name):
+    def register(setup):
+        benchmarks[name] = setup
+        return setup
+    return register
+
+def get_rng():
+    return runner.get_shoe_rng(SEED, 0)
+
+def get_shoe(decks=blackjack.DECKS_PER_SHOE):
+    shoe = blackjack.fill_shoe(decks)
+    shoe.shuffle(get_rng())
+    return shoe
+
+def replay(play_shoe):
+    # play_shoe(rng) with the generator rewound each call, so every call plays
+    # the same shoe
+    rng = get_rng()
+    state = rng.bit_generator.state
+    def run():
+        rng.bit_generator.state = state
+        return play_shoe(rng)
+    return run
+
+class RoundCounter:
+    # The eventlog.RoundRecorder interface, only counting rounds
+    rounds = 0
+
+    def start_shoe(self):
+        pass
+
+    def add_decision(self, decision, insurance):
+        pass
+
+    def record_round(self, *fields):
+        self.rounds += 1
+
+def get_blackjack_shoe_setup(config):
+    def setup():
+        counter = RoundCounter()
+        replay(lambda rng: blackjack.play(rng, counter, config))()
+        return replay(lambda rng: blackjack.play(rng, config=config)), counter.rounds
+    return setup
+
+# Micro benchmarks
+
+@benchmark('blackjack.count_this_card')
+def count_this_card_setup():
+    cards = list(get_shoe().cards)
+    config = blackjack.get_config()
+    def run():
+        count = 0.0
+        for card in cards:
+            count = blackjack.count_this_card(card, count, None, config)
+    return run, len(cards)
+
+@benchmark('blackjack.SideBetTracker.remove_card')
+def remove_card_setup():
+    shoe = get_shoe()
+    cards = list(shoe.cards[:len(shoe.cards) // 2])
+    def run():
+        tracker = blackjack.SideBetTracker(shoe)
+        for card in cards:
+            tracker.remove_card(card)
+    return run, len(cards)
+
+@benchmark('blackjack.Hand')
+def hand_setup():
+    # Hand replaced get_current_total(): building a hand keeps its total
+    cards = list(get_shoe().cards)
+    deals = [cards[i:i + 3] for i in range(0, len(cards) - 2, 3)]
+    def run():
+        for deal in deals:
+            blackjack.Hand(0, deal)
+    return run, len(deals)
+
+@benchmark('blackjack.get_decision')
+def get_decision_setup():
+    cards = list(get_shoe().cards)
+    rng = get_rng()
+    cases = [(blackjack.CARD_RANKS[cards[i]], blackjack.Hand(0, cards[i + 1:i + 3]), float(true_count))
+             for i, true_count in zip(range(0, len(cards) - 3, 3), rng.normal(0.0, 2.0, len(cards)))]
+    def run():
+        for dealer_up_card, player_hand, true_count in cases:
+            blackjack.get_decision(dealer_up_card, player_hand, true_count, 0, 1)
+    return run, len(cases)
+
+@benchmark('blackjack.play_round')
+def play_round_setup():
+    # Each round is dealt with deal_round(), which is part of the timing
+    shoe = get_shoe()
+    config = blackjack.get_config(count_the_pp_side_bet=False, count_the_plus3_side_bet=False)
+    rounds = 200
+    def run():
+        shoe.position = 0
+        count = 0.0
+        for x in range(0,rounds):
+            if len(shoe) < 30:
+                shoe.position = 0
+                count = 0.0
+            players_hands = [blackjack.Hand(config.normal_bet_amount)]
+            players_hands, dealer_hand, count = blackjack.deal_round(shoe, players_hands, count, None, (), config)
+            outcome, pp_outcome, plus3_outcome, count = blackjack.play_round(
+                shoe, players_hands, dealer_hand, count, config.normal_bet_amount, 0, 0, config=config)
+    return run, rounds
+
+@benchmark('blackjack.get_pp_ev')
+def get_pp_ev_setup():
+    shoe = get_shoe()
+    shoe.position = len(shoe.cards) // 2
+    return lambda: blackjack.get_pp_ev(shoe), 1
+
+@benchmark('blackjack.get_plus3_ev')
+def get_plus3_ev_setup():
+    shoe = get_shoe()
+    shoe.position = len(shoe.cards) // 2
+    return lambda: blackjack.get_plus3_ev(shoe), 1
+
+@benchmark('baccarat.play_shoe')
+def baccarat_play_shoe_setup():
+    return replay(lambda rng: baccarat.play_shoe(rng=rng)), 1
+
+@benchmark('baccarat.play_shoe_table')
+def baccarat_play_shoe_table_setup():
+    baccarat.get_outcome_table()  # Built or loaded once, outside the timing
+    return replay(lambda rng: baccarat.play_shoe_table(rng=rng)), 1
+
+# Macro benchmarks play a full shoe per run. Blackjack shoes are timed per
+# round, so 1 / best is hands per second; batch and baccarat per shoe.
+
+benchmark('blackjack.play')(get_blackjack_shoe_setup(blackjack.get_config()))
+
+def register_scaling_benchmarks():
+    # blackjack.play over every deck count, with and without side bets
+    for decks in DECK_SIZES:
+        for side_bets in (False, True):
+            config = blackjack.get_config(decks_per_shoe=decks, count_the_pp_side_bet=side_bets,
+                                          count_the_plus3_side_bet=side_bets)
+            name = 'blackjack.play[decks=' + str(decks) + ',side_bets=' + ('on' if side_bets else 'off') + ']'
+            benchmark(name)(get_blackjack_shoe_setup(config))
+
+register_scaling_benchmarks()
+
+@benchmark('blackjack_batch.play_shuffled_shoes')
+def batch_setup():
+    config = blackjack.get_config()
+    shoes = runner.shuffle_shoes(blackjack.fill_shoe(config.decks_per_shoe).cards, BATCH_SHOES, SEED)
+    return lambda: blackjack_batch.play_shuffled_shoes(shoes, config), BATCH_SHOES
+
+def time_benchmark(setup, repeat=REPEAT, min_seconds=MIN_SECONDS):
+    # Best and median seconds per operation over repeat timings
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):  # get_bet_amount() prints
+        run, ops = setup()
+        timer = timeit.Timer(run)
+        number = 1
+        while timer.timeit(number) < min_seconds:
+            number *= 2
+        times = [seconds / (number * ops) for seconds in timer.repeat(repeat, number)]
+    return {'ops': ops, 'number': number, 'best': min(times), 'median': statistics.median(times)}
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_benchmarks(names=None, repeat=REPEAT, min_seconds=MIN_SECONDS):
+    # (name, result) for each benchmark as it finishes, only those whose names
+    # contain one of names if given
+    for name in benchmarks:
+        if names is None or any(pattern in name for pattern in names):
+            yield name, time_benchmark(benchmarks[name], repeat, min_seconds)
+
+def format_seconds(seconds):
+    for unit, scale in (('s', 1.0), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return str(round(seconds / scale, 2)) + ' ' + unit
+    return str(round(seconds / 1e-9, 1)) + ' ns'
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the blackjack and baccarat hot paths')
+    parser.add_argument('filter', nargs='*', help='only run benchmarks whose names contain one of these')
+    parser.add_argument('--json', metavar='PATH', help='save the results to PATH')
+    parser.add_argument('--compare', metavar='PATH', help='show the change from the results saved at PATH')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='timings per benchmark')
+    parser.add_argument('--min-seconds', type=float, default=MIN_SECONDS, help='minimum length of each timing')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as saved:
+            baseline = json.load(saved)['benchmarks']
+    results = {}
+    for name, result in run_benchmarks(args.filter or None, args.repeat, args.min_seconds):
+        results[name] = result
+        line = name + ' = ' + format_seconds(result['best']) + ' per op (median ' + format_seconds(result['median']) + ')'
+        if name in baseline:
+            line += ', ' + str(round(baseline[name]['best'] / result['best'], 2)) + 'x baseline'
+        print(line)
+    if args.json:
+        report = {'commit': get_commit(), 'python': platform.python_version(), 'numpy': np.__version__,
+                  'machine': platform.machine(), 'processor': platform.processor(), 'seed': SEED,
+                  'benchmarks': results}
+        with open(args.json, 'w') as saved:
+            json.dump(report, saved, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
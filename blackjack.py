@@ -4,28 +4,47 @@ blackjack.py
 Simulator for online live dealer blackjack at the Golden Nugget
 """
 
-import itertools
+import collections
+import contextlib
+import functools
 import math
 import os
 import random
 import sys
+from array import array
 
-import matplotlib.pyplot as plt
+import runner
+import stats
 
+SHOES_TO_PLAY = 50
 STARTING_BANKROLL = 5000
 DECKS_PER_SHOE = 8
-NUMBER_OF_OTHER_PLAYERS = 5
+NUMBER_OF_OTHER_PLAYERS = 5  # Seats dealt and played before ours, we sit at third base
+OTHER_PLAYERS_STRATEGY = 'S17'  # Flat basic strategy from STRATEGIES, or DEALER to hit below 17
 PENETRATION = 0.50  # Dealer plays 50% of shoe then shuffles
 BLACKJACK_PAYOUT = 1.5  # 3:2
 HIT_SPLIT_ACES = False
 NORMAL_BET_AMOUNT = 25
 BET_ONLY_WHEN_FAVORABLE_COUNT = True
-CARD_COUNTING_SYSTEM = 'WONG_HALVES'  # WONG_HALVES, HI_LO
-FAVORABLE_COUNT_THRESHOLD = 1.0
+STRATEGY = 'S17'  # S17 (with surrender) or H17 tables from STRATEGIES, or OPTIMAL to solve every decision
+CARD_COUNTING_SYSTEM = 'WONG_HALVES'  # HI_LO, WONG_HALVES, KO, HI_OPT_I, HI_OPT_II, OMEGA_II or ZEN
+FAVORABLE_COUNT_THRESHOLD = 1.0  # Hi-Lo scale true count, see get_true_count
+KEY_COUNT = None  # Running count KO bets at, None for the usual key count for DECKS_PER_SHOE
 COUNT_THE_PP_SIDE_BET = True
 PP_EV_THRESHOLD = 0.0
-COUNT_THE_PLUS3_SIDE_BET = False # Note that turning this on extends runtime significantly
+COUNT_THE_PLUS3_SIDE_BET = False
 PLUS3_EV_THRESHOLD = 0.0
+EV_MODE = False  # Score rounds against the dealer outcome odds instead of drawing the dealer's cards
+EXACT_DEALER_ODDS = False  # EV mode odds from the exact draw-out recursion, far slower, see get_dealer_odds
+DEALER_CACHE_SIZE = 4096  # Exact dealer odds kept in the LRU cache, see set_dealer_cache_size
+SOLVER_CACHE_SIZE = 65536  # Decisions kept in the OPTIMAL strategy's LRU cache, see set_solver_cache_size
+# Rounding each rank count to this many cards makes the caches hit more often,
+# but the odds are then worked out from the rounded counts, so anything above
+# 1 is an approximation. EXACT_DEALER_ODDS scores rounds with the dealer
+# resolution and defaults to exact; the OPTIMAL strategy only picks actions
+# with its EVs.
+DEALER_CACHE_RESOLUTION = 1
+SOLVER_CACHE_RESOLUTION = 8
 
 # TODO appropriate these original params below
 """
@@ -36,18 +55,58 @@ DOUBLE_AFTER_SPLIT = True
 DOUBLE_ON_ANY_TWO_CARDS = True
 """
 
-def play():
-    bankroll = STARTING_BANKROLL
-    shoe = fill_shoe(DECKS_PER_SHOE)
-    random.shuffle(shoe)
+# The settings above that one run plays by, as a Config (see get_config).
+# play() passes its config down so sweeps can run many side by side without
+# touching the module globals.
+CONFIG_FIELDS = ['decks_per_shoe', 'penetration', 'starting_bankroll', 'number_of_other_players',
+                 'other_players_strategy', 'blackjack_payout', 'hit_split_aces', 'normal_bet_amount',
+                 'bet_only_when_favorable_count', 'strategy', 'card_counting_system', 'favorable_count_threshold',
+                 'key_count', 'count_the_pp_side_bet', 'pp_ev_threshold', 'count_the_plus3_side_bet', 'plus3_ev_threshold',
+                 'ev_mode', 'exact_dealer_odds']
+Config = collections.namedtuple('Config', CONFIG_FIELDS)
+
+def get_config(**changes):
+    # The current module settings, with any fields in changes replaced
+    return Config(*[globals()[name.upper()] for name in CONFIG_FIELDS])._replace(**changes)
+
+def play(rng=None, recorder=None, config=None, cards=None):
+    # rng is a numpy Generator for this shoe (see runner.get_shoe_rng), None
+    # shuffles with the random module. cards plays an already shuffled shoe
+    # instead, like a row of a shoelib library. recorder is an
+    # eventlog.RoundRecorder to log every round to. config defaults to
+    # get_config().
+    if config is None:
+        config = get_config()
+    bankroll = config.starting_bankroll
+    shoe = fill_shoe(config.decks_per_shoe)
+    if cards is None:
+        shoe.shuffle(rng)
+    else:
+        shoe.load(cards)
     starting_number_of_cards = len(shoe)
-    count = 0.0
+    count = get_initial_count(config.card_counting_system, config.decks_per_shoe)
     pnl = 0.0
-    while (float(len(shoe)) / float(starting_number_of_cards)) > (1 - PENETRATION):
-        bet_amt, pp_amt, plus3_amt = get_bet_amount(count, shoe, bankroll)
-        players_hands = [{'hand':[],'bet_amt':bet_amt}]
-        players_hands, dealer_hand, count = deal_round(shoe, players_hands, count)
-        outcome, pp_outcome, plus3_outcome, count = play_round(shoe, players_hands, dealer_hand, count, bet_amt, pp_amt, plus3_amt)
+    tracker = None
+    if config.count_the_pp_side_bet or config.count_the_plus3_side_bet:
+        tracker = SideBetTracker(shoe)
+    if recorder is not None:
+        recorder.start_shoe()
+    while (float(len(shoe)) / float(starting_number_of_cards)) > (1 - config.penetration):
+        if recorder is not None:
+            cards_left = len(shoe)
+            bet_true_count = get_true_count(count, cards_left, config)
+        bet_amt, pp_amt, plus3_amt = get_bet_amount(count, shoe, bankroll, tracker, config)
+        players_hands = [Hand(bet_amt)]
+        other_hands = [Hand() for x in range(0,config.number_of_other_players)]
+        players_hands, dealer_hand, count = deal_round(shoe, players_hands, count, tracker, other_hands, config)
+        if other_hands:
+            count = play_other_hands(shoe, other_hands, dealer_hand, count, tracker, config)
+        outcome, pp_outcome, plus3_outcome, count = play_round(shoe, players_hands, dealer_hand, count, bet_amt, pp_amt, plus3_amt, tracker, recorder, config)
+        if other_hands and not config.ev_mode:
+            dealer_hand, count = finish_dealer_hand(dealer_hand, shoe, count, tracker, config)
+        if recorder is not None:
+            recorder.record_round(bet_true_count, bet_amt, pp_amt, plus3_amt,
+                                  outcome, pp_outcome, plus3_outcome, cards_left - len(shoe))
         pnl += outcome
         pnl += pp_outcome
         pnl += plus3_outcome
@@ -56,9 +115,11 @@ def play():
         bankroll += plus3_outcome
     return pnl
 
-def play_round(shoe, players_hands, dealer_hand, count, bet_amt, pp_amt, plus3_amt):
-    dealer_up_card = dealer_hand[0][0]
-    dealer_down_card = dealer_hand[1][0]
+def play_round(shoe, players_hands, dealer_hand, count, bet_amt, pp_amt, plus3_amt, tracker=None, recorder=None, config=None):
+    if config is None:
+        config = get_config()
+    dealer_up_card = CARD_RANKS[dealer_hand.cards[0]]
+    dealer_down_card = CARD_RANKS[dealer_hand.cards[1]]
 
     outcome = 0 # Net win/loss after each round, need to account for insurance
     pp_outcome = 0 # Keeping "Perfect Pair" side bet outcome separate
@@ -68,21 +129,28 @@ def play_round(shoe, players_hands, dealer_hand, count, bet_amt, pp_amt, plus3_a
     aces_split = False # Under certain circumstances we ensure only 1 more card after split aces
 
     for player_hand in players_hands:
-        if HIT_SPLIT_ACES == False and aces_split == True:
+        if config.hit_split_aces == False and aces_split == True:
             break  # Here can only get 1 more card after split aces
 
-        true_count = get_true_count(count, shoe)
+        true_count = get_true_count(count, len(shoe), config)
         round_count = 0 # Track whether we're on first 2 cards or not
         while True:
             if round_count == 0:
                 if pp_amt > 0 and pp_outcome == 0:
-                    pp_outcome = pp_amt * evaluate_pp(player_hand['hand'])
+                    pp_outcome = pp_amt * evaluate_pp(player_hand.cards)
                 if plus3_amt > 0 and plus3_outcome == 0:
-                    three_card_hand = player_hand['hand']
-                    three_card_hand.append(dealer_up_card)
-                    plus3_outcome = plus3_amt * evaluate_plus3(player_hand['hand'])
+                    three_card_hand = player_hand.cards + [dealer_hand.cards[0]]
+                    plus3_outcome = plus3_amt * evaluate_plus3(three_card_hand)
 
-            decision, insurance = get_decision(dealer_up_card, player_hand['hand'], true_count, split_count, round_count)
+            if config.strategy == 'OPTIMAL':
+                unseen = get_rank_composition(shoe)
+                unseen[CARD_HARD_VALUES[dealer_hand.cards[1]] - 1] += 1
+                decision, insurance = get_optimal_decision(dealer_up_card, player_hand, unseen, true_count, split_count,
+                                                           round_count, config.hit_split_aces)
+            else:
+                decision, insurance = get_decision(dealer_up_card, player_hand, true_count, split_count, round_count, config.strategy)
+            if recorder is not None:
+                recorder.add_decision(decision, insurance)
 
             dealer_has_bj = False
             if dealer_up_card == 'A' and (dealer_down_card == 'T' or dealer_down_card == 'J' or dealer_down_card == 'Q' or dealer_down_card == 'K'):
@@ -92,71 +160,68 @@ def play_round(shoe, players_hands, dealer_hand, count, bet_amt, pp_amt, plus3_a
 
             if insurance:
                 if decision == 'blackjack': # Take even money
-                    count = count_this_card(dealer_down_card, count)
+                    count = count_this_card(dealer_hand.cards[1], count, tracker, config)
                     return bet_amt, pp_outcome, plus3_outcome, count
                 elif dealer_has_bj: # And player doesn't have blackjack
-                    count = count_this_card(dealer_down_card, count)
+                    count = count_this_card(dealer_hand.cards[1], count, tracker, config)
                     return 0, pp_outcome, plus3_outcome, count
                 else: # Neither have blackjack
                     outcome -= (bet_amt / 2.0)
             elif dealer_has_bj:
-                count = count_this_card(dealer_down_card, count)
+                count = count_this_card(dealer_hand.cards[1], count, tracker, config)
                 if decision == 'blackjack':
                     return 0, pp_outcome, plus3_outcome, count
                 else:
                     return -bet_amt, pp_outcome, plus3_outcome, count
             elif decision == 'blackjack':
-                count = count_this_card(dealer_down_card, count)
-                return (bet_amt * BLACKJACK_PAYOUT), pp_outcome, plus3_outcome, count
+                count = count_this_card(dealer_hand.cards[1], count, tracker, config)
+                return (bet_amt * config.blackjack_payout), pp_outcome, plus3_outcome, count
 
             if decision == 'split':
                 split_count += 1
                 splits_indices.append(players_hands.index(player_hand))
-                if player_hand['hand'][0][0] == 'A':
+                if CARD_RANKS[player_hand.cards[0]] == 'A':
                     aces_split = True
                 next_card = get_card(shoe)
-                count = count_this_card(next_card, count)
-                players_hands.append({'hand':[player_hand['hand'][0], next_card],'bet_amt':bet_amt})
+                count = count_this_card(next_card, count, tracker, config)
+                players_hands.append(Hand(bet_amt, [player_hand.cards[0], next_card]))
                 next_card = get_card(shoe)
-                count = count_this_card(next_card, count)
-                players_hands.append({'hand':[player_hand['hand'][1], next_card],'bet_amt':bet_amt})
+                count = count_this_card(next_card, count, tracker, config)
+                players_hands.append(Hand(bet_amt, [player_hand.cards[1], next_card]))
                 break
             elif decision == 'double':
                 if round_count > 0:
                     # Just hit
                     next_card = get_card(shoe)
-                    count = count_this_card(next_card, count)
-                    player_hand['hand'].append(next_card)
-                    player_current_total, softhard_player, splittable = get_current_total(player_hand['hand'])
-                    if player_current_total > 21:
+                    count = count_this_card(next_card, count, tracker, config)
+                    player_hand.add(next_card)
+                    if player_hand.total > 21:
                         break
                 else:
                     next_card = get_card(shoe)
-                    count = count_this_card(next_card, count)
-                    player_hand['hand'].append(next_card)
-                    player_hand['bet_amt'] += bet_amt
+                    count = count_this_card(next_card, count, tracker, config)
+                    player_hand.add(next_card)
+                    player_hand.bet_amt += bet_amt
                     break
             elif decision == 'hit':
                 next_card = get_card(shoe)
-                count = count_this_card(next_card, count)
-                player_hand['hand'].append(next_card)
-                player_current_total, softhard_player, splittable = get_current_total(player_hand['hand'])
+                count = count_this_card(next_card, count, tracker, config)
+                player_hand.add(next_card)
                 round_count += 1
-                if player_current_total > 21:
+                if player_hand.total > 21:
                     break
             elif decision == 'surrender':
                 if round_count > 0:
                     # Just hit
                     next_card = get_card(shoe)
-                    count = count_this_card(next_card, count)
-                    player_hand['hand'].append(next_card)
-                    player_current_total, softhard_player, splittable = get_current_total(player_hand['hand'])
-                    if player_current_total > 21:
+                    count = count_this_card(next_card, count, tracker, config)
+                    player_hand.add(next_card)
+                    if player_hand.total > 21:
                         break
                 else:
                     # Halve bet amount, treat as a bust by adding fake 10 to hand
-                    player_hand['bet_amt'] -= bet_amt * 0.5
-                    player_hand['hand'].append('Tx')
+                    player_hand.bet_amt -= bet_amt * 0.5
+                    player_hand.add(FILLER_TEN)
                     break
             elif decision == 'stand':
                 break
@@ -164,87 +229,369 @@ def play_round(shoe, players_hands, dealer_hand, count, bet_amt, pp_amt, plus3_a
     for index in reversed(splits_indices): # Remove hands that were split
         players_hands.pop(index)
 
-    dealer_hand, count = play_dealer_hand(dealer_hand, shoe, count)
-    this_round_outcome = round_outcome(players_hands, dealer_hand)
+    if config.ev_mode:
+        count = count_this_card(dealer_hand.cards[1], count, tracker, config)
+        if any(player_hand.bet_amt for player_hand in players_hands):
+            # The hole card is still unseen when the player acts
+            unseen = get_rank_composition(shoe)
+            unseen[CARD_HARD_VALUES[dealer_hand.cards[1]] - 1] += 1
+            dealer_odds = get_dealer_odds(dealer_hand.cards[0], unseen, config.exact_dealer_odds)
+            this_round_outcome = expected_round_outcome(players_hands, dealer_odds)
+        else:
+            this_round_outcome = 0  # Sitting out, nothing to score
+    else:
+        dealer_hand, count = play_dealer_hand(dealer_hand, shoe, count, tracker, config)
+        this_round_outcome = round_outcome(players_hands, dealer_hand)
     outcome += this_round_outcome
 
     return outcome, pp_outcome, plus3_outcome, count
 
-def play_dealer_hand(dealer_hand, shoe, count):
-    count = count_this_card(dealer_hand[1], count)
-    while True:
-        dealer_current_total, softhard_dealer, splittable = get_current_total(dealer_hand)
-        if (dealer_current_total < 17):
-            next_card = get_card(shoe)
-            count = count_this_card(next_card, count)
-            dealer_hand.append(next_card)
-        else:
-            break
+def play_dealer_hand(dealer_hand, shoe, count, tracker=None, config=None):
+    count = count_this_card(dealer_hand.cards[1], count, tracker, config)
+    while dealer_hand.total < 17:
+        next_card = get_card(shoe)
+        count = count_this_card(next_card, count, tracker, config)
+        dealer_hand.add(next_card)
     return dealer_hand, count
 
+def finish_dealer_hand(dealer_hand, shoe, count, tracker=None, config=None):
+    # play_round() doesn't draw the dealer's cards when our hand is settled on
+    # the deal, but the other seats still need the dealer to play out. The
+    # hole card has been counted by then.
+    while dealer_hand.total < 17:
+        next_card = get_card(shoe)
+        count = count_this_card(next_card, count, tracker, config)
+        dealer_hand.add(next_card)
+    return dealer_hand, count
+
+def play_other_hands(shoe, other_hands, dealer_hand, count, tracker=None, config=None):
+    # The other seats play flat config.other_players_strategy without
+    # splitting. Like our hand, a surrender just stops drawing and past two
+    # cards doubles and surrenders are hits. Only the cards they take matter.
+    if config is None:
+        config = get_config()
+    if dealer_hand.total == 21:
+        return count  # Dealer blackjack, nobody plays
+    if config.other_players_strategy == 'DEALER':
+        for hand in other_hands:
+            while hand.total < 17:
+                next_card = get_card(shoe)
+                count = count_this_card(next_card, count, tracker, config)
+                hand.add(next_card)
+        return count
+    plays = get_compiled_strategy(config.other_players_strategy).plays
+    column = DEALER_COLUMNS[CARD_RANKS[dealer_hand.cards[0]]] + get_count_bucket(0.0)
+    for hand in other_hands:
+        decision = plays[((22 if hand.soft else 0) + hand.total) * ROW_SIZE + column]
+        while decision != 'stand' and not (decision == 'surrender' and len(hand.cards) == 2):
+            next_card = get_card(shoe)
+            count = count_this_card(next_card, count, tracker, config)
+            hand.add(next_card)
+            if hand.total > 21 or (decision == 'double' and len(hand.cards) == 3):
+                break
+            decision = plays[((22 if hand.soft else 0) + hand.total) * ROW_SIZE + column]
+    return count
+
 def round_outcome(players_hands, dealer_hand):
     outcome = 0
+    dealer_current_total = dealer_hand.total
     for player_hand in players_hands:
-        player_current_total, softhard_player, splittable = get_current_total(player_hand['hand'])
-        dealer_current_total, softhard_dealer, splittable = get_current_total(dealer_hand)
+        player_current_total = player_hand.total
         if player_current_total > 21:
-            outcome -= player_hand['bet_amt']
+            outcome -= player_hand.bet_amt
         elif player_current_total > dealer_current_total or (dealer_current_total > 21):
-            outcome += player_hand['bet_amt']
+            outcome += player_hand.bet_amt
         elif player_current_total == dealer_current_total:
             continue
         elif player_current_total < dealer_current_total:
-            outcome -= player_hand['bet_amt']
+            outcome -= player_hand.bet_amt
+    return outcome
+
+def expected_round_outcome(players_hands, dealer_odds):
+    # Same scoring as round_outcome, averaged over the dealer's final totals
+    outcome = 0.0
+    for player_hand in players_hands:
+        player_current_total = player_hand.total
+        if player_current_total > 21:
+            outcome -= player_hand.bet_amt
+            continue
+        win = dealer_odds[5]  # Dealer busts
+        lose = 0.0
+        for dealer_current_total, probability in zip(range(17,22), dealer_odds):
+            if player_current_total > dealer_current_total:
+                win += probability
+            elif player_current_total < dealer_current_total:
+                lose += probability
+        outcome += player_hand.bet_amt * (win - lose)
     return outcome
 
+def get_rank_composition(shoe):
+    # Remaining count of each card value: aces, 2 through 9, then tens
+    values = shoe.cards[shoe.position:].tobytes().translate(CARD_VALUE_INDEXES)
+    return [values.count(value) for value in range(0,10)]
+
+def get_dealer_outcomes(hard_total, aces, counts, cards, memo):
+    # Odds of the dealer finishing on 17, 18, 19, 20, 21 or busting from this
+    # hand, standing on all 17s like play_dealer_hand
+    total = hard_total + 10 if aces and hard_total <= 11 else hard_total
+    if total >= 17:
+        outcomes = [0.0] * 6
+        outcomes[total - 17 if total <= 21 else 5] = 1.0
+        return outcomes
+    key = (hard_total, aces > 0, tuple(counts))
+    if key in memo:
+        return memo[key]
+    outcomes = [0.0] * 6
+    for value in range(0,10):
+        n = counts[value]
+        if n:
+            probability = n / cards
+            counts[value] -= 1
+            drawn = get_dealer_outcomes(hard_total + value + 1, aces + (value == 0), counts, cards - 1, memo)
+            counts[value] += 1
+            for i in range(0,6):
+                outcomes[i] += probability * drawn[i]
+    memo[key] = outcomes
+    return outcomes
+
+def compute_dealer_odds(up_value, counts):
+    # up_value counts aces as 1. The hole card comes from counts too, but can't
+    # give the dealer blackjack since those rounds end before the dealer plays.
+    counts = list(counts)
+    cards = sum(counts)
+    blackjack_hole = 9 if up_value == 1 else 0 if up_value == 10 else None
+    hole_cards = cards - (counts[blackjack_hole] if blackjack_hole is not None else 0)
+    memo = {}
+    odds = [0.0] * 6
+    for value in range(0,10):
+        n = counts[value]
+        if n and value != blackjack_hole:
+            probability = n / hole_cards
+            counts[value] -= 1
+            drawn = get_dealer_outcomes(up_value + value + 1, (up_value == 1) + (value == 0), counts, cards - 1, memo)
+            counts[value] += 1
+            for i in range(0,6):
+                odds[i] += probability * drawn[i]
+    return tuple(odds)
+
+def compute_fixed_dealer_odds(up_value, counts):
+    # compute_dealer_odds() with every card after the hole card drawn at the
+    # odds of counts, as if the dealer's draws didn't change the composition.
+    # Each total's odds stay within about 0.001 of the exact ones at 50%
+    # penetration of 8 decks, and walking the dealer's hands in order of hard
+    # total takes a few hundred multiplications instead of a recursion over
+    # every draw.
+    cards = sum(counts)
+    p = [n / cards for n in counts]
+    blackjack_hole = 9 if up_value == 1 else 0 if up_value == 10 else None
+    hole_scale = 1.0 / (1.0 - p[blackjack_hole]) if blackjack_hole is not None else 1.0
+    # Chance of the dealer holding each hard total, with and without an ace
+    hard = [0.0] * 27
+    soft = [0.0] * 27
+    for value in range(0,10):
+        if value != blackjack_hole:
+            (soft if up_value == 1 or value == 0 else hard)[up_value + value + 1] += p[value] * hole_scale
+    draws = list(enumerate(p[1:], 2))
+    odds = [0.0] * 6
+    for hard_total in range(2,27):
+        chance = soft[hard_total]
+        if chance:
+            if hard_total <= 6:  # Soft 12-16, draw
+                for value, probability in enumerate(p, 1):
+                    soft[hard_total + value] += chance * probability
+            elif hard_total <= 11:  # Soft 17-21
+                odds[hard_total - 7] += chance
+            else:
+                hard[hard_total] += chance  # The ace counts as 1
+        chance = hard[hard_total]
+        if chance:
+            if hard_total >= 17:
+                odds[hard_total - 17 if hard_total <= 21 else 5] += chance
+            else:
+                soft[hard_total + 1] += chance * p[0]
+                for value, probability in draws:
+                    hard[hard_total + value] += chance * probability
+    return tuple(odds)
+
+dealer_odds_cache = functools.lru_cache(maxsize=DEALER_CACHE_SIZE)(compute_dealer_odds)
+
+def set_dealer_cache_size(maxsize):
+    # Swaps in an empty cache holding up to maxsize compositions (None for no limit)
+    global dealer_odds_cache
+    dealer_odds_cache = functools.lru_cache(maxsize=maxsize)(compute_dealer_odds)
+
+def get_dealer_odds(up_card, counts, exact=False):
+    # Odds of the dealer finishing on 17, 18, 19, 20, 21 or busting given the
+    # up card and the unseen value counts (from get_rank_composition). exact
+    # runs the full recursion through the LRU cache, which costs tens of ms a
+    # composition, instead of compute_fixed_dealer_odds().
+    if not exact:
+        return compute_fixed_dealer_odds(CARD_HARD_VALUES[up_card], counts)
+    resolution = DEALER_CACHE_RESOLUTION
+    coarse_counts = tuple(int(n / resolution + 0.5) * resolution for n in counts)
+    return dealer_odds_cache(CARD_HARD_VALUES[up_card], coarse_counts)
+
+def get_stand_evs(dealer_odds):
+    # EV per unit bet of standing on each total 0-21
+    bust = dealer_odds[5]
+    stand_evs = [2.0 * bust - 1.0] * 22  # Under 17 only wins if the dealer busts
+    for total in range(17,22):
+        win = bust + sum(dealer_odds[0:total-17])
+        lose = sum(dealer_odds[total-16:5])
+        stand_evs[total] = win - lose
+    return stand_evs
+
+def get_hit_ev(hard_total, aces, counts, cards, stand_evs, memo):
+    # EV of taking a card, then hitting again or standing, whichever is better
+    key = (hard_total, aces > 0, tuple(counts))
+    if key in memo:
+        return memo[key]
+    ev = 0.0
+    for value in range(0,10):
+        n = counts[value]
+        if n:
+            new_hard_total = hard_total + value + 1
+            new_aces = aces + (value == 0)
+            total = new_hard_total + 10 if new_aces and new_hard_total <= 11 else new_hard_total
+            if total > 21:
+                ev -= n / cards
+                continue
+            best = stand_evs[total]
+            if total < 21:
+                counts[value] -= 1
+                best = max(best, get_hit_ev(new_hard_total, new_aces, counts, cards - 1, stand_evs, memo))
+                counts[value] += 1
+            ev += n / cards * best
+    memo[key] = ev
+    return ev
+
+def get_double_ev(hard_total, aces, counts, cards, stand_evs):
+    ev = 0.0
+    for value in range(0,10):
+        n = counts[value]
+        if n:
+            new_hard_total = hard_total + value + 1
+            total = new_hard_total + 10 if (aces or value == 0) and new_hard_total <= 11 else new_hard_total
+            ev += n / cards * (stand_evs[total] if total <= 21 else -1.0)
+    return 2.0 * ev
+
+def compute_action_evs(up_value, counts, hard_total, aces, pair_value, first_action, can_split, hit_split_aces):
+    # EV per unit bet of every action allowed in this spot. The dealer's odds are
+    # taken from counts once and not adjusted for the player's later hits. A split
+    # is scored as two hands that get one card each and then play on without
+    # resplitting; split aces get one card only unless hit_split_aces, like
+    # play_round.
+    counts = list(counts)
+    cards = sum(counts)
+    stand_evs = get_stand_evs(dealer_odds_cache(up_value, tuple(counts)))
+    memo = {}
+    total = hard_total + 10 if aces and hard_total <= 11 else hard_total
+    evs = [('stand', stand_evs[total]), ('hit', get_hit_ev(hard_total, aces, counts, cards, stand_evs, memo))]
+    if first_action:
+        evs.append(('double', get_double_ev(hard_total, aces, counts, cards, stand_evs)))
+        evs.append(('surrender', -0.5))
+    if can_split:
+        split_ev = 0.0
+        for value in range(0,10):
+            n = counts[value]
+            if not n:
+                continue
+            new_hard_total = pair_value + value + 1
+            new_aces = (pair_value == 1) + (value == 0)
+            new_total = new_hard_total + 10 if new_aces and new_hard_total <= 11 else new_hard_total
+            counts[value] -= 1
+            if pair_value == 1 and not hit_split_aces:
+                best = stand_evs[new_total]
+            else:
+                best = max(stand_evs[new_total],
+                           get_hit_ev(new_hard_total, new_aces, counts, cards - 1, stand_evs, memo),
+                           get_double_ev(new_hard_total, new_aces, counts, cards - 1, stand_evs))
+            counts[value] += 1
+            split_ev += n / cards * best
+        evs.append(('split', 2.0 * split_ev))
+    return tuple(evs)
+
+solver_cache = functools.lru_cache(maxsize=SOLVER_CACHE_SIZE)(compute_action_evs)
+
+def set_solver_cache_size(maxsize):
+    # Swaps in an empty cache holding up to maxsize spots (None for no limit)
+    global solver_cache
+    solver_cache = functools.lru_cache(maxsize=maxsize)(compute_action_evs)
+
+def get_action_evs(dealer_up_card, player_hand, counts, split_count, round_count, hit_split_aces=None):
+    # EV per unit bet of each action open to player_hand, given the dealer's up
+    # card rank and the unseen value counts (from get_rank_composition).
+    # hit_split_aces defaults to HIT_SPLIT_ACES.
+    if hit_split_aces is None:
+        hit_split_aces = HIT_SPLIT_ACES
+    resolution = SOLVER_CACHE_RESOLUTION
+    coarse_counts = tuple(int(n / resolution + 0.5) * resolution for n in counts)
+    up_value = 1 if dealer_up_card == 'A' else RANK_VALUES[dealer_up_card]
+    can_split = player_hand.pair and split_count < 2
+    pair_value = CARD_HARD_VALUES[player_hand.cards[0]] if can_split else 0
+    return solver_cache(up_value, coarse_counts, player_hand.hard_total, min(player_hand.aces, 1),
+                        pair_value, round_count == 0, can_split, hit_split_aces)
+
+def get_optimal_decision(dealer_up_card, player_hand, counts, true_count, split_count, round_count,
+                         hit_split_aces=None):
+    # Same contract as get_decision, but plays the best EV action for the unseen cards
+    insurance = False
+    if round_count == 0:
+        # Check insurance
+        if dealer_up_card == 'A' and true_count >= 3.0:
+            insurance = True
+        if player_hand.total == 21:
+            return 'blackjack', insurance
+    evs = get_action_evs(dealer_up_card, player_hand, counts, split_count, round_count, hit_split_aces)
+    return max(evs, key=lambda action_ev: action_ev[1])[0], insurance
+
 ## H17 ##
-"""
-#form: splits_table[player_card_pair][dealer_card]
-splits_table = {'2': {'2':'Y','3':'Y','4':'Y','5':'Y','6':'Y','7':'Y','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
-                '3': {'2':'Y','3':'Y','4':'Y','5':'Y','6':'Y','7':'Y','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
-                '4': {'2':'N','3':'N','4':'N','5':'Y','6':'Y','7':'N','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
-                '5': {'2':'N','3':'N','4':'N','5':'N','6':'N','7':'N','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
-                '6': {'2':'Y','3':'Y','4':'Y','5':'Y','6':'Y','7':'N','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
-                '7': {'2':'Y','3':'Y','4':'Y','5':'Y','6':'Y','7':'Y','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
-                '8': {'2':'Y','3':'Y','4':'Y','5':'Y','6':'Y','7':'Y','8':'Y','9':'Y','T':'Y','J':'Y','Q':'Y','K':'Y','A':'Y'},
-                '9': {'2':'Y','3':'Y','4':'Y','5':'Y','6':'Y','7':'N','8':'Y','9':'Y','T':'N','J':'N','Q':'N','K':'N','A':'N'},
-                'T': {'2':'N','3':'N','4':'N','5':'N','6':'N','7':'N','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
-                'J': {'2':'N','3':'N','4':'N','5':'N','6':'N','7':'N','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
-                'Q': {'2':'N','3':'N','4':'N','5':'N','6':'N','7':'N','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
-                'K': {'2':'N','3':'N','4':'N','5':'N','6':'N','7':'N','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
-                'A': {'2':'Y','3':'Y','4':'Y','5':'Y','6':'Y','7':'Y','8':'Y','9':'Y','T':'Y','J':'Y','Q':'Y','K':'Y','A':'Y'}}
-#form: softs_table[player_value][dealer_up_card]
-softs_table = {13: {'2':'hit','3':'hit','4':'hit','5':'double','6':'double','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                14: {'2':'hit','3':'hit','4':'hit','5':'double','6':'double','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                15: {'2':'hit','3':'hit','4':'double','5':'double','6':'double','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                16: {'2':'hit','3':'hit','4':'double','5':'double','6':'double','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                17: {'2':'hit','3':'double','4':'double','5':'double','6':'double','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                18: {'2':'double','3':'double','4':'double','5':'double','6':'double','7':'stand','8':'stand','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                19: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'double','7':'stand','8':'stand','9':'stand','T':'stand','J':'stand','Q':'stand','K':'stand','A':'stand'},
-                20: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'stand','8':'stand','9':'stand','T':'stand','J':'stand','Q':'stand','K':'stand','A':'stand'},
-                21: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'stand','8':'stand','9':'stand','T':'stand','J':'stand','Q':'stand','K':'stand','A':'stand'}}
-#form: softs_table[player_value][dealer_up_card]
-hards_table = {2: {'2':'hit','3':'hit','4':'hit','5':'hit','6':'hit','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                3: {'2':'hit','3':'hit','4':'hit','5':'hit','6':'hit','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                4: {'2':'hit','3':'hit','4':'hit','5':'hit','6':'hit','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                5: {'2':'hit','3':'hit','4':'hit','5':'hit','6':'hit','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                6: {'2':'hit','3':'hit','4':'hit','5':'hit','6':'hit','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                7: {'2':'hit','3':'hit','4':'hit','5':'hit','6':'hit','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                8: {'2':'hit','3':'hit','4':'hit','5':'hit','6':'hit','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                9: {'2':'hit','3':'double','4':'double','5':'double','6':'double','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                10: {'2':'double','3':'double','4':'double','5':'double','6':'double','7':'double','8':'double','9':'double','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                11: {'2':'double','3':'double','4':'double','5':'double','6':'double','7':'double','8':'double','9':'double','T':'double','J':'double','Q':'double','K':'double','A':'double'},
-                12: {'2':'hit','3':'hit','4':'stand','5':'stand','6':'stand','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                13: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                14: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                15: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                16: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
-                17: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'stand','8':'stand','9':'stand','T':'stand','J':'stand','Q':'stand','K':'stand','A':'stand'},
-                18: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'stand','8':'stand','9':'stand','T':'stand','J':'stand','Q':'stand','K':'stand','A':'stand'},
-                19: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'stand','8':'stand','9':'stand','T':'stand','J':'stand','Q':'stand','K':'stand','A':'stand'},
-                20: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'stand','8':'stand','9':'stand','T':'stand','J':'stand','Q':'stand','K':'stand','A':'stand'},
-                21: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'stand','8':'stand','9':'stand','T':'stand','J':'stand','Q':'stand','K':'stand','A':'stand'}}
-"""
+#form: h17_splits_table[player_card_pair][dealer_card]
+h17_splits_table = {'2': {'2':'Y','3':'Y','4':'Y','5':'Y','6':'Y','7':'Y','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
+                    '3': {'2':'Y','3':'Y','4':'Y','5':'Y','6':'Y','7':'Y','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
+                    '4': {'2':'N','3':'N','4':'N','5':'Y','6':'Y','7':'N','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
+                    '5': {'2':'N','3':'N','4':'N','5':'N','6':'N','7':'N','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
+                    '6': {'2':'Y','3':'Y','4':'Y','5':'Y','6':'Y','7':'N','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
+                    '7': {'2':'Y','3':'Y','4':'Y','5':'Y','6':'Y','7':'Y','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
+                    '8': {'2':'Y','3':'Y','4':'Y','5':'Y','6':'Y','7':'Y','8':'Y','9':'Y','T':'Y','J':'Y','Q':'Y','K':'Y','A':'Y'},
+                    '9': {'2':'Y','3':'Y','4':'Y','5':'Y','6':'Y','7':'N','8':'Y','9':'Y','T':'N','J':'N','Q':'N','K':'N','A':'N'},
+                    'T': {'2':'N','3':'N','4':'N','5':'N','6':'N','7':'N','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
+                    'J': {'2':'N','3':'N','4':'N','5':'N','6':'N','7':'N','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
+                    'Q': {'2':'N','3':'N','4':'N','5':'N','6':'N','7':'N','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
+                    'K': {'2':'N','3':'N','4':'N','5':'N','6':'N','7':'N','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
+                    'A': {'2':'Y','3':'Y','4':'Y','5':'Y','6':'Y','7':'Y','8':'Y','9':'Y','T':'Y','J':'Y','Q':'Y','K':'Y','A':'Y'}}
+#form: h17_softs_table[player_value][dealer_up_card]
+h17_softs_table = {13: {'2':'hit','3':'hit','4':'hit','5':'double','6':'double','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    14: {'2':'hit','3':'hit','4':'hit','5':'double','6':'double','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    15: {'2':'hit','3':'hit','4':'double','5':'double','6':'double','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    16: {'2':'hit','3':'hit','4':'double','5':'double','6':'double','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    17: {'2':'hit','3':'double','4':'double','5':'double','6':'double','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    18: {'2':'double','3':'double','4':'double','5':'double','6':'double','7':'stand','8':'stand','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    19: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'double','7':'stand','8':'stand','9':'stand','T':'stand','J':'stand','Q':'stand','K':'stand','A':'stand'},
+                    20: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'stand','8':'stand','9':'stand','T':'stand','J':'stand','Q':'stand','K':'stand','A':'stand'},
+                    21: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'stand','8':'stand','9':'stand','T':'stand','J':'stand','Q':'stand','K':'stand','A':'stand'}}
+#form: h17_softs_table[player_value][dealer_up_card]
+h17_hards_table = {2: {'2':'hit','3':'hit','4':'hit','5':'hit','6':'hit','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    3: {'2':'hit','3':'hit','4':'hit','5':'hit','6':'hit','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    4: {'2':'hit','3':'hit','4':'hit','5':'hit','6':'hit','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    5: {'2':'hit','3':'hit','4':'hit','5':'hit','6':'hit','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    6: {'2':'hit','3':'hit','4':'hit','5':'hit','6':'hit','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    7: {'2':'hit','3':'hit','4':'hit','5':'hit','6':'hit','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    8: {'2':'hit','3':'hit','4':'hit','5':'hit','6':'hit','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    9: {'2':'hit','3':'double','4':'double','5':'double','6':'double','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    10: {'2':'double','3':'double','4':'double','5':'double','6':'double','7':'double','8':'double','9':'double','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    11: {'2':'double','3':'double','4':'double','5':'double','6':'double','7':'double','8':'double','9':'double','T':'double','J':'double','Q':'double','K':'double','A':'double'},
+                    12: {'2':'hit','3':'hit','4':'stand','5':'stand','6':'stand','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    13: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    14: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    15: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    16: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'hit','8':'hit','9':'hit','T':'hit','J':'hit','Q':'hit','K':'hit','A':'hit'},
+                    17: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'stand','8':'stand','9':'stand','T':'stand','J':'stand','Q':'stand','K':'stand','A':'stand'},
+                    18: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'stand','8':'stand','9':'stand','T':'stand','J':'stand','Q':'stand','K':'stand','A':'stand'},
+                    19: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'stand','8':'stand','9':'stand','T':'stand','J':'stand','Q':'stand','K':'stand','A':'stand'},
+                    20: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'stand','8':'stand','9':'stand','T':'stand','J':'stand','Q':'stand','K':'stand','A':'stand'},
+                    21: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'stand','8':'stand','9':'stand','T':'stand','J':'stand','Q':'stand','K':'stand','A':'stand'}}
+
 ## S17, SURRENDER ##
 #form: splits_table[player_card_pair][dealer_card]
 splits_table = {'2': {'2':'Y','3':'Y','4':'Y','5':'Y','6':'Y','7':'Y','8':'N','9':'N','T':'N','J':'N','Q':'N','K':'N','A':'N'},
@@ -295,8 +642,93 @@ hards_table = {2: {'2':'hit','3':'hit','4':'hit','5':'hit','6':'hit','7':'hit','
                 21: {'2':'stand','3':'stand','4':'stand','5':'stand','6':'stand','7':'stand','8':'stand','9':'stand','T':'stand','J':'stand','Q':'stand','K':'stand','A':'stand'}}
 
 
-def get_decision(dealer_up_card, player_hand, true_count, split_count, round_count):
-    player_current_total, softhard_player, splittable = get_current_total(player_hand)
+# Basic strategy tables by name, (splits, softs, hards)
+STRATEGIES = {'S17': (splits_table, softs_table, hards_table),
+              'H17': (h17_splits_table, h17_softs_table, h17_hards_table)}
+
+# Count-based deviations from basic strategy, checked in this order before the tables.
+# (player total, 'soft'/'hard'/None for either, dealer up cards, true count test, decision)
+# The soft doubles (A8 v 4/5, A6 v 2) are left out: the old checks compared the
+# up card to ints, so they never fired, and leaving them out keeps decisions
+# the same as before.
+INDEX_PLAYS = [(12, None, '4', '<=', 0.0, 'hit'),
+               (19, 'soft', 'A23456789TJQK', '<=', 0.0, 'stand'),
+               (13, None, '2', '<=', -1.0, 'hit'),
+               (16, None, 'TJQK', '>', 0.0, 'stand'),
+               (9, None, '2', '>=', 1.0, 'double'),
+               (12, None, '3', '>=', 2.0, 'stand'),
+               (8, None, '6', '>=', 2.0, 'double'),
+               (16, None, 'A', '>=', 3.0, 'stand'),
+               (12, None, '2', '>=', 3.0, 'stand'),
+               (10, None, 'A', '>=', 3.0, 'double'),
+               (9, None, '7', '>=', 3.0, 'double'),
+               (16, None, '9', '>=', 4.0, 'stand'),
+               (15, None, 'TJQK', '>=', 4.0, 'stand'),
+               (10, None, 'TJQK', '>=', 4.0, 'double'),
+               (15, None, 'A', '>=', 5.0, 'stand')]
+# (pair ranks, dealer up cards, true count test) to split a pair the table doesn't
+PAIR_INDEX_PLAYS = [('TJQK', '4', '>=', 6.0),
+                    ('TJQK', '5', '>=', 5.0),
+                    ('TJQK', '6', '>=', 4.0)]
+
+# Every index play threshold falls on an edge of these buckets:
+# (-inf,-1] (-1,0] (0,1) [1,2) [2,3) [3,4) [4,5) [5,6) [6,inf)
+COUNT_BUCKETS = 9
+BUCKET_TRUE_COUNTS = [-1.0, -0.5, 0.5, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0]  # One true count inside each bucket
+RANK_VALUES = {'A':11,'2':2,'3':3,'4':4,'5':5,'6':6,'7':7,'8':8,'9':9,'T':10,'J':10,'Q':10,'K':10}
+ROW_SIZE = 12 * COUNT_BUCKETS  # One row per player hand, dealer value 0-11 by count bucket
+DEALER_COLUMNS = {rank: value * COUNT_BUCKETS for rank, value in RANK_VALUES.items()}
+
+CompiledStrategy = collections.namedtuple('CompiledStrategy', ['splits', 'plays'])
+compiled_strategies = {}
+
+def get_count_bucket(true_count):
+    if true_count <= 0.0:
+        return 0 if true_count <= -1.0 else 1
+    return 2 + min(int(true_count), 6)
+
+def passes_count_test(true_count, test, threshold):
+    if test == '<=':
+        return true_count <= threshold
+    elif test == '>':
+        return true_count > threshold
+    return true_count >= threshold
+
+def compile_strategy(splits, softs, hards, index_plays=INDEX_PLAYS, pair_index_plays=PAIR_INDEX_PLAYS):
+    # Flattens the tables and index plays into two dense lists:
+    #   splits[pair value * ROW_SIZE + dealer value * COUNT_BUCKETS + bucket] -> split or not
+    #   plays[(soft * 22 + total) * ROW_SIZE + dealer value * COUNT_BUCKETS + bucket] -> decision
+    # Card values are 2-11 with aces as 11. The tables stay the source of truth.
+    compiled_splits = [False] * (12 * 12 * COUNT_BUCKETS)
+    compiled_plays = [None] * (2 * 22 * 12 * COUNT_BUCKETS)
+    for dealer_card in RANKS:
+        dealer_value = RANK_VALUES[dealer_card]
+        for bucket, true_count in enumerate(BUCKET_TRUE_COUNTS):
+            for pair_card, row in splits.items():
+                split = row[dealer_card] == 'Y'
+                for pair_cards, dealer_cards, test, threshold in pair_index_plays:
+                    if pair_card in pair_cards and dealer_card in dealer_cards and passes_count_test(true_count, test, threshold):
+                        split = True
+                compiled_splits[(RANK_VALUES[pair_card] * 12 + dealer_value) * COUNT_BUCKETS + bucket] = split
+            for soft, table in ((0, hards), (1, softs)):
+                for total in range(2,22):
+                    # Soft totals missing from the table (soft 12) play like the hard total
+                    decision = table[total][dealer_card] if total in table else hards[total][dealer_card]
+                    for play_total, softhard, dealer_cards, test, threshold, play in index_plays:
+                        if (play_total == total and softhard in (None, ('hard', 'soft')[soft]) and dealer_card in dealer_cards
+                                and passes_count_test(true_count, test, threshold)):
+                            decision = play
+                            break
+                    compiled_plays[((soft * 22 + total) * 12 + dealer_value) * COUNT_BUCKETS + bucket] = decision
+    return CompiledStrategy(compiled_splits, compiled_plays)
+
+def get_compiled_strategy(name):
+    if name not in compiled_strategies:
+        compiled_strategies[name] = compile_strategy(*STRATEGIES[name])
+    return compiled_strategies[name]
+
+def get_decision(dealer_up_card, player_hand, true_count, split_count, round_count, strategy=None):
+    player_current_total = player_hand.total
 
     insurance = False
     if round_count == 0:
@@ -306,164 +738,216 @@ def get_decision(dealer_up_card, player_hand, true_count, split_count, round_cou
         if player_current_total == 21:
             return 'blackjack', insurance
 
-    # Check split
-    if splittable and split_count < 2:
-        pair_value = player_hand[0][0]
-        split_or_not = splits_table[pair_value][dealer_up_card]
-        if split_or_not == 'Y':
-            return 'split', insurance
-        elif (pair_value == 'T' or pair_value == 'J' or pair_value == 'Q' or pair_value == 'K'):
-            if dealer_up_card == '4' and true_count >= 6.0:
-                return 'split', insurance
-            elif dealer_up_card == '5' and true_count >= 5.0:
-                return 'split', insurance
-            elif dealer_up_card == '6' and true_count >= 4.0:
-                return 'split', insurance
-
-    # Strategy adjustments based on count
+    if strategy is None:
+        strategy = STRATEGY
+    splits, plays = compiled_strategies.get(strategy) or get_compiled_strategy(strategy)
+    # Same as get_count_bucket, inlined since this runs on every decision
     if true_count <= 0.0:
-        if player_current_total == 12 and dealer_up_card == '4':
-            return 'hit', insurance
-        elif softhard_player == 'soft' and player_current_total == 19:
-            return 'stand', insurance
-        if true_count <= -1.0:
-            if player_current_total == 13 and dealer_up_card == '2':
-                return 'hit', insurance
-    elif true_count > 0.0:
-        if player_current_total == 16 and (dealer_up_card == 'T' or dealer_up_card == 'J' or dealer_up_card == 'Q' or dealer_up_card == 'K'):
-            return 'stand', insurance
-        if true_count >= 1.0:
-            if (softhard_player == 'soft' and player_current_total == 19) and dealer_up_card == 5:
-                return 'double', insurance
-            elif (softhard_player == 'soft' and player_current_total == 17) and dealer_up_card == 2:
-                return 'double', insurance
-            elif player_current_total == 9 and dealer_up_card == '2':
-                return 'double', insurance
-            if true_count >= 2.0:
-                if player_current_total == 12 and dealer_up_card == '3':
-                    return 'stand', insurance
-                elif player_current_total == 8 and dealer_up_card == '6':
-                    return 'double', insurance
-                if true_count >= 3.0:
-                    if (softhard_player == 'soft' and player_current_total == 19) and dealer_up_card == 4:
-                        return 'double', insurance
-                    elif player_current_total == 16 and dealer_up_card == 'A':
-                        return 'stand', insurance
-                    elif player_current_total == 12 and dealer_up_card == '2':
-                        return 'stand', insurance
-                    elif player_current_total == 10 and dealer_up_card == 'A':
-                        return 'double', insurance
-                    elif player_current_total == 9 and dealer_up_card == '7':
-                        return 'double', insurance
-                    if true_count >= 4.0:
-                        if player_current_total == 16 and dealer_up_card == '9':
-                                return 'stand', insurance
-                        elif player_current_total == 15 and (dealer_up_card == 'T' or dealer_up_card == 'J' or dealer_up_card == 'Q' or dealer_up_card == 'K'):
-                            return 'stand', insurance
-                        elif player_current_total == 10 and (dealer_up_card == 'T' or dealer_up_card == 'J' or dealer_up_card == 'Q' or dealer_up_card == 'K'):
-                            return 'double', insurance
-                        if true_count >= 5.0:
-                            if player_current_total == 15 and dealer_up_card == 'A':
-                                return 'stand', insurance
-
-    # If no split or adjustment should be made based on count, play basic strategy
-    if softhard_player == 'soft':
-        return softs_table[player_current_total][dealer_up_card], insurance
-    elif softhard_player == 'hard':
-        return hards_table[player_current_total][dealer_up_card], insurance
-
-def get_current_total(player_hand):
-    softhard = 'hard'
-    ace_count = 0
-    value = 0
-    for card in player_hand:
-        card_val = card[0]
-        if card_val == 'A':
-            value += 11
-            softhard = 'soft'
-            ace_count += 1
-        elif card_val == 'K' or card_val == 'Q' or card_val == 'J' or card_val == 'T':
-            value += 10
+        bucket = 0 if true_count <= -1.0 else 1
+    elif true_count >= 6.0:
+        bucket = 8
+    else:
+        bucket = 2 + int(true_count)
+    column = DEALER_COLUMNS[dealer_up_card] + bucket
+
+    # Check split, including count-based splits
+    if player_hand.pair and split_count < 2 and splits[CARD_VALUES[player_hand.cards[0]] * ROW_SIZE + column]:
+        return 'split', insurance
+
+    # Basic strategy with count adjustments already folded in
+    if player_hand.soft:
+        return plays[(22 + player_current_total) * ROW_SIZE + column], insurance
+    return plays[player_current_total * ROW_SIZE + column], insurance
+
+class Hand:
+    # Cards in a hand plus running totals, kept current as each card is added
+
+    __slots__ = ('cards', 'bet_amt', 'hard_total', 'aces', 'total', 'soft', 'pair')
+
+    def __init__(self, bet_amt=0, cards=()):
+        self.cards = []
+        self.bet_amt = bet_amt
+        self.hard_total = 0  # Aces as 1
+        self.aces = 0
+        self.total = 0
+        self.soft = False
+        self.pair = False  # First two cards share a rank
+        for card in cards:
+            self.add(card)
+
+    def add(self, card):
+        cards = self.cards
+        cards.append(card)
+        self.hard_total += CARD_HARD_VALUES[card]
+        if CARD_RANKS[card] == 'A':
+            self.aces += 1
+        if len(cards) == 2:
+            self.pair = CARD_RANKS[cards[0]] == CARD_RANKS[card]
+        # One ace counts as 11 if that doesn't bust. An ace-ten 21 plays as hard.
+        if self.aces and self.hard_total <= 11:
+            self.total = self.hard_total + 10
+            self.soft = self.hard_total <= 10
         else:
-            this_val = int(card_val)
-            value += this_val
-    non_soft_value = value
-    for x in range(0,ace_count):
-        if value > 21 and softhard == 'soft':
-            value -= 10
-        non_soft_value -= 10
-    if non_soft_value >= 11 and softhard == 'soft':
-        softhard = 'hard'
-    splittable = False
-    if player_hand[0][0] == player_hand[1][0]:
-        splittable = True
-    return value, softhard, splittable
-
-def get_true_count(count, shoe):
-    decks_remaining = float(len(shoe)) / 52.0
-    return float(count) / decks_remaining
-
-def deal_round(shoe, players_hands, count):
-    for player_hand in players_hands:
+            self.total = self.hard_total
+            self.soft = False
+
+def deal_round(shoe, players_hands, count, tracker=None, other_hands=(), config=None):
+    # The other seats are dealt before us, every card face up
+    for player_hand in list(other_hands) + players_hands:
         next_card = get_card(shoe)
-        count = count_this_card(next_card, count)
-        player_hand['hand'].append(next_card)
+        count = count_this_card(next_card, count, tracker, config)
+        player_hand.add(next_card)
         next_card = get_card(shoe)
-        count = count_this_card(next_card, count)
-        player_hand['hand'].append(next_card)
-    dealer_hand = []
+        count = count_this_card(next_card, count, tracker, config)
+        player_hand.add(next_card)
+    dealer_hand = Hand()
     next_card = get_card(shoe)
-    dealer_hand.append(next_card)
-    count = count_this_card(next_card, count)
+    dealer_hand.add(next_card)
+    count = count_this_card(next_card, count, tracker, config)
     next_card = get_card(shoe)
-    dealer_hand.append(next_card)
+    dealer_hand.add(next_card)
     # Don't count this yet - player can't see it...
     return players_hands, dealer_hand, count
 
-def count_this_card(card, count):
-    card_val = card[0]
-    if CARD_COUNTING_SYSTEM == 'HI_LO':
-        # Hi-lo system (Level I)
-        if card_val == 'A' or card_val == 'K' or card_val == 'Q' or card_val == 'J' or card_val == 'T':
-            return count - 1.0
-        elif card_val == '6' or card_val == '5' or card_val == '4' or card_val == '3' or card_val == '2':
-            return count + 1.0
-        # Otherwise count stays the same so...
-    elif CARD_COUNTING_SYSTEM == 'WONG_HALVES':
-        # Stanford Wong's Halves system (Level III)
-        if card_val == 'T' or card_val == 'J' or card_val == 'Q' or card_val == 'K' or card_val == 'A':
-            return count - 1.0
-        elif card_val == '2' or card_val == '7':
-            return count + 0.5
-        elif card_val == '3' or card_val == '4' or card_val == '6':
-            return count + 1.0
-        elif card_val == '5':
-            return count + 1.5
-        elif card_val == '9':
-            return count - 0.5
-        # And 8's don't affect the count so...
-    return count
+def count_this_card(card, count, tracker=None, config=None):
+    if tracker is not None:
+        tracker.remove_card(card)
+    system = CARD_COUNTING_SYSTEM if config is None else config.card_counting_system
+    return count + COUNT_TAGS[system][card]
+
+RANKS = 'A23456789TJQK'
+SUITS = 'shdc'
+
+# Lookup tables indexed by card code, code = suit * 13 + rank
+CARD_NAMES = [rank + suit for suit in SUITS for rank in RANKS]
+CARD_RANKS = [name[0] for name in CARD_NAMES]
+CARD_SUITS = [name[1] for name in CARD_NAMES]
+CARD_VALUES = [11 if rank == 'A' else 10 if rank in 'TJQK' else int(rank) for rank in CARD_RANKS]
+CARD_HARD_VALUES = [1 if rank == 'A' else value for rank, value in zip(CARD_RANKS, CARD_VALUES)]
+FILLER_TEN = CARD_NAMES.index('Ts')  # Added to a surrendered hand so it scores as a bust
+# bytes.translate() table from card code to get_rank_composition() index
+CARD_VALUE_INDEXES = bytes([value - 1 for value in CARD_HARD_VALUES] + [0] * (256 - len(CARD_HARD_VALUES)))
+
+RANK_COUNT_TAGS = {
+    # Hi-lo system (Level I)
+    'HI_LO': {'2':1.0,'3':1.0,'4':1.0,'5':1.0,'6':1.0,'7':0.0,'8':0.0,'9':0.0,
+              'T':-1.0,'J':-1.0,'Q':-1.0,'K':-1.0,'A':-1.0},
+    # Stanford Wong's Halves system (Level III)
+    'WONG_HALVES': {'2':0.5,'3':1.0,'4':1.0,'5':1.5,'6':1.0,'7':0.5,'8':0.0,'9':-0.5,
+                    'T':-1.0,'J':-1.0,'Q':-1.0,'K':-1.0,'A':-1.0},
+    # Knock-out system (Level I, unbalanced: a full deck counts +4, see
+    # UNBALANCED_DECK_COUNTS)
+    'KO': {'2':1.0,'3':1.0,'4':1.0,'5':1.0,'6':1.0,'7':1.0,'8':0.0,'9':0.0,
+           'T':-1.0,'J':-1.0,'Q':-1.0,'K':-1.0,'A':-1.0},
+    # Hi-Opt I (Level I, ace neutral)
+    'HI_OPT_I': {'2':0.0,'3':1.0,'4':1.0,'5':1.0,'6':1.0,'7':0.0,'8':0.0,'9':0.0,
+                 'T':-1.0,'J':-1.0,'Q':-1.0,'K':-1.0,'A':0.0},
+    # Hi-Opt II (Level II, ace neutral)
+    'HI_OPT_II': {'2':1.0,'3':1.0,'4':2.0,'5':2.0,'6':1.0,'7':1.0,'8':0.0,'9':0.0,
+                  'T':-2.0,'J':-2.0,'Q':-2.0,'K':-2.0,'A':0.0},
+    # Omega II (Level II, ace neutral)
+    'OMEGA_II': {'2':1.0,'3':1.0,'4':2.0,'5':2.0,'6':2.0,'7':1.0,'8':0.0,'9':-1.0,
+                 'T':-2.0,'J':-2.0,'Q':-2.0,'K':-2.0,'A':0.0},
+    # Zen count (Level II)
+    'ZEN': {'2':1.0,'3':1.0,'4':2.0,'5':2.0,'6':2.0,'7':1.0,'8':0.0,'9':0.0,
+            'T':-2.0,'J':-2.0,'Q':-2.0,'K':-2.0,'A':-1.0}}
+# Registry of counting systems: each one's tag for every card code, so
+# counting a card is one list index. Add a system to RANK_COUNT_TAGS to use
+# it as CARD_COUNTING_SYSTEM or score it with blackjack_batch.score_counting_systems().
+COUNT_TAGS = {system: [tags[rank] for rank in CARD_RANKS] for system, tags in RANK_COUNT_TAGS.items()}
+COUNTING_SYSTEMS = list(COUNT_TAGS)
+# FAVORABLE_COUNT_THRESHOLD and the index plays are Hi-Lo true counts. Level
+# II tags run about twice as large, so get_true_count() divides their counts
+# by this to bring them to the Hi-Lo scale; Wong Halves counts in half points
+# to stay on it already.
+COUNT_THRESHOLD_SCALES = {'HI_LO': 1.0, 'WONG_HALVES': 1.0, 'KO': 1.0, 'HI_OPT_I': 1.0,
+                          'HI_OPT_II': 2.0, 'OMEGA_II': 2.0, 'ZEN': 2.0}
+# Unbalanced systems and what one full deck counts. They start at an initial
+# running count (IRC) that brings the whole shoe to that total, and bet on
+# the running count against a key count instead of converting to a true count.
+UNBALANCED_DECK_COUNTS = {'KO': 4.0}
+
+def get_initial_count(system, decks):
+    if system in UNBALANCED_DECK_COUNTS:
+        return -UNBALANCED_DECK_COUNTS[system] * (decks - 1)
+    return 0.0
+
+def get_key_count(config):
+    # KEY_COUNT, or a line through the published KO key counts of +2 at one
+    # deck and -6 at eight, which rounds to the +1 and -4 published for two
+    # and six decks as well
+    if config.key_count is not None:
+        return config.key_count
+    return float(round(2.0 - 8.0 * (config.decks_per_shoe - 1) / 7.0))
+
+def get_true_count(count, cards_left, config, system=None):
+    # A running count as a Hi-Lo scale true count, for the bet threshold, the
+    # index plays and insurance. Unbalanced counts first lose their IRC and
+    # what the cards seen so far add on average, level II counts are divided
+    # by their COUNT_THRESHOLD_SCALES. count and cards_left can also be numpy
+    # arrays. system defaults to config's counting system.
+    if system is None:
+        system = config.card_counting_system
+    decks_left = cards_left / 52.0
+    if system in UNBALANCED_DECK_COUNTS:
+        decks_seen = config.decks_per_shoe - decks_left
+        count = (count - get_initial_count(system, config.decks_per_shoe) -
+                 UNBALANCED_DECK_COUNTS[system] * decks_seen)
+    return count / COUNT_THRESHOLD_SCALES[system] / decks_left
+
+def is_favorable_count(count, cards_left, config, system=None):
+    # Whether get_bet_amount() bets at this running count with cards_left
+    # unseen. count and cards_left can also be numpy arrays. system defaults
+    # to config's counting system.
+    if system is None:
+        system = config.card_counting_system
+    if system in UNBALANCED_DECK_COUNTS:
+        return count >= get_key_count(config)
+    return get_true_count(count, cards_left, config, system) > config.favorable_count_threshold
+
+class Shoe:
+    # Card codes in dealing order, with a cursor marking the next card to deal
+
+    def __init__(self, decks):
+        self.cards = array('B', range(0,52)) * decks
+        self.position = 0
+
+    def shuffle(self, rng=None):
+        if rng is None:
+            random.shuffle(self.cards)
+        else:
+            import numpy as np  # Already loaded if there's a Generator to shuffle with
+            rng.shuffle(np.frombuffer(self.cards, dtype=np.uint8))
+        self.position = 0
+
+    def load(self, cards):
+        # Card codes in dealing order, any buffer of bytes
+        self.cards = array('B', bytes(cards))
+        self.position = 0
+
+    def draw(self):
+        if self.position < len(self.cards):
+            card = self.cards[self.position]
+            self.position += 1
+            return card
+        return None
+
+    def __len__(self):
+        return len(self.cards) - self.position
+
+    def __iter__(self):
+        return iter(self.cards[self.position:])
 
 def fill_shoe(decks):
-    new_deck = ['As','2s','3s','4s','5s','6s','7s','8s','9s','Ts','Js','Qs','Ks',
-            'Ah','2h','3h','4h','5h','6h','7h','8h','9h','Th','Jh','Qh','Kh',
-            'Ad','2d','3d','4d','5d','6d','7d','8d','9d','Td','Jd','Qd','Kd',
-            'Ac','2c','3c','4c','5c','6c','7c','8c','9c','Tc','Jc','Qc','Kc']
-    shoe = []
-    for x in range(0,decks):
-        shoe.extend(new_deck)
-    return shoe
+    return Shoe(decks)
 
 def get_card(shoe):
-    if len(shoe) > 0:
-        return shoe.pop(0)
-    else:
-        return None
+    return shoe.draw()
 
 def evaluate_pp(hand):
-    c1_suit, c2_suit = hand[0][1], hand[1][1]
+    c1_suit, c2_suit = CARD_SUITS[hand[0]], CARD_SUITS[hand[1]]
     same_suit = (c1_suit == c2_suit)
-    c1_rank, c2_rank = hand[0][0], hand[1][0]
+    c1_rank, c2_rank = CARD_RANKS[hand[0]], CARD_RANKS[hand[1]]
     same_rank = (c1_rank == c2_rank)
     if same_suit and same_rank:
         # "Perfect pair" pays 25:1
@@ -494,8 +978,8 @@ def check_for_strt(c1_rank, c2_rank, c3_rank):
     return False
 
 def evaluate_plus3(hand):
-    c1_rank, c2_rank, c3_rank = hand[0][0], hand[1][0], hand[2][0]
-    c1_suit, c2_suit, c3_suit = hand[0][1], hand[1][1], hand[2][1]
+    c1_rank, c2_rank, c3_rank = CARD_RANKS[hand[0]], CARD_RANKS[hand[1]], CARD_RANKS[hand[2]]
+    c1_suit, c2_suit, c3_suit = CARD_SUITS[hand[0]], CARD_SUITS[hand[1]], CARD_SUITS[hand[2]]
     same_rank = (c1_rank == c2_rank == c3_rank)
     same_suit = (c1_suit == c2_suit == c3_suit)
     if same_rank and same_suit:
@@ -517,53 +1001,310 @@ def evaluate_plus3(hand):
     # Don't have anything so lost the 1 unit
     return -1
 
+SUIT_OFFSETS = (0, 13, 26, 39)  # s, h, d, c
+
+def get_shoe_composition(shoe):
+    # Remaining count of every card code, 52 entries
+    composition = [0] * 52
+    for card in shoe:
+        composition[card] += 1
+    return composition
+
+def choose_2(n):
+    return n * (n - 1) // 2
+
+def choose_3(n):
+    return n * (n - 1) * (n - 2) // 6
+
+def get_pp_yield(perfect_pairs, colored_pairs, mixed_pairs, cards):
+    # Colored pairs are same color but different suit, mixed pairs are different color
+    losers = choose_2(cards) - perfect_pairs - colored_pairs - mixed_pairs
+    return 25 * perfect_pairs + 12 * colored_pairs + 6 * mixed_pairs - losers
+
+def get_plus3_yield(suited_trips, rank_trips, straights, straight_flushes, suited_triples, cards):
+    # Rank trips, straights and suited triples are raw counts that still include
+    # the better-paying hands nested inside them, so peel those off first
+    trips = rank_trips - suited_trips
+    plain_straights = straights - straight_flushes
+    flushes = suited_triples - suited_trips - straight_flushes
+    winners = suited_trips + trips + straight_flushes + plain_straights + flushes
+    losers = choose_3(cards) - winners
+    return 100 * suited_trips + 25 * trips + 40 * straight_flushes + 10 * plain_straights + 5 * flushes - losers
+
+# A23 through QKA, same windows as check_for_strt
+STRAIGHT_WINDOWS = [(low, low + 1, (low + 2) % 13) for low in range(0,12)]
+# For each rank, the other two ranks of every straight window it sits in
+STRAIGHT_NEIGHBOURS = [[tuple(r for r in window if r != rank) for window in STRAIGHT_WINDOWS if rank in window]
+                       for rank in range(0,13)]
+
+def get_pp_categories(composition):
+    # Number of 2-card combinations landing in each Perfect Pair category
+    perfect_pairs = 0
+    colored_pairs = 0
+    mixed_pairs = 0
+    for rank in range(0,13):
+        s, h, d, c = composition[rank], composition[13+rank], composition[26+rank], composition[39+rank]
+        perfect_pairs += choose_2(s) + choose_2(h) + choose_2(d) + choose_2(c)
+        colored_pairs += s * c + h * d  # Both black or both red
+        mixed_pairs += (s + c) * (h + d)
+    return perfect_pairs, colored_pairs, mixed_pairs
+
+def get_plus3_categories(composition):
+    # Raw 3-card combination counts for get_plus3_yield
+    rank_totals = [composition[r] + composition[13+r] + composition[26+r] + composition[39+r] for r in range(0,13)]
+    suited_trips = sum(choose_3(n) for n in composition)
+    rank_trips = sum(choose_3(n) for n in rank_totals)
+    straights = 0
+    straight_flushes = 0
+    for low, mid, high in STRAIGHT_WINDOWS:
+        straights += rank_totals[low] * rank_totals[mid] * rank_totals[high]
+        for offset in SUIT_OFFSETS:
+            straight_flushes += composition[offset+low] * composition[offset+mid] * composition[offset+high]
+    suited_triples = sum(choose_3(sum(composition[offset:offset+13])) for offset in SUIT_OFFSETS)
+    return suited_trips, rank_trips, straights, straight_flushes, suited_triples
+
+def get_pp_ev_from_composition(composition):
+    # Same yield as summing evaluate_pp over every 2-card combination,
+    # but counted per category so cost doesn't depend on shoe size
+    return get_pp_yield(*get_pp_categories(composition), sum(composition))
+
+def get_plus3_ev_from_composition(composition):
+    # Same yield as summing evaluate_plus3 over every 3-card combination
+    return get_plus3_yield(*get_plus3_categories(composition), sum(composition))
+
 def get_pp_ev(shoe):
-    permutations = itertools.combinations(shoe, 2)
-    yield_ = 0
-    for permutation in permutations:
-        yield_ += evaluate_pp(permutation)
-    return yield_
+    return get_pp_ev_from_composition(get_shoe_composition(shoe))
 
 def get_plus3_ev(shoe):
-    permutations = itertools.combinations(shoe, 3)
-    yield_ = 0
-    for permutation in permutations:
-        yield_ += evaluate_plus3(permutation)
-    return yield_
-
-def get_bet_amount(count, shoe, bankroll):
-    true_count = get_true_count(count, shoe)
+    return get_plus3_ev_from_composition(get_shoe_composition(shoe))
+
+class SideBetTracker:
+    # Keeps the Perfect Pair and 21+3 category sums for the unseen cards and
+    # adjusts them as each card is counted, so reading the EV is O(1)
+
+    def __init__(self, shoe):
+        self.composition = get_shoe_composition(shoe)
+        self.rank_totals = [sum(self.composition[offset+r] for offset in SUIT_OFFSETS) for r in range(0,13)]
+        self.suit_totals = [sum(self.composition[offset:offset+13]) for offset in SUIT_OFFSETS]
+        self.cards = len(shoe)
+        self.perfect_pairs, self.colored_pairs, self.mixed_pairs = get_pp_categories(self.composition)
+        (self.suited_trips, self.rank_trips, self.straights,
+         self.straight_flushes, self.suited_triples) = get_plus3_categories(self.composition)
+
+    def remove_card(self, card):
+        suit, rank = divmod(card, 13)
+        offset = suit * 13
+        composition = self.composition
+        rank_totals = self.rank_totals
+        n = composition[card]
+        same_color = composition[(3 - suit) * 13 + rank]  # s <-> c, h <-> d
+        self.perfect_pairs -= n - 1
+        self.colored_pairs -= same_color
+        self.mixed_pairs -= rank_totals[rank] - n - same_color
+        self.suited_trips -= choose_2(n - 1)
+        self.rank_trips -= choose_2(rank_totals[rank] - 1)
+        self.suited_triples -= choose_2(self.suit_totals[suit] - 1)
+        for a, b in STRAIGHT_NEIGHBOURS[rank]:
+            self.straights -= rank_totals[a] * rank_totals[b]
+            self.straight_flushes -= composition[offset+a] * composition[offset+b]
+        composition[card] -= 1
+        rank_totals[rank] -= 1
+        self.suit_totals[suit] -= 1
+        self.cards -= 1
+
+    def pp_ev(self):
+        return get_pp_yield(self.perfect_pairs, self.colored_pairs, self.mixed_pairs, self.cards)
+
+    def plus3_ev(self):
+        return get_plus3_yield(self.suited_trips, self.rank_trips, self.straights,
+                               self.straight_flushes, self.suited_triples, self.cards)
+
+def get_bet_amount(count, shoe, bankroll, tracker=None, config=None):
+    if config is None:
+        config = get_config()
     bet_amt = 0
     pp_amt = 0
     plus3_amt = 0
-    if BET_ONLY_WHEN_FAVORABLE_COUNT:
-        if true_count > FAVORABLE_COUNT_THRESHOLD:
-            bet_amt = NORMAL_BET_AMOUNT
+    if config.bet_only_when_favorable_count:
+        if is_favorable_count(count, len(shoe), config):
+            bet_amt = config.normal_bet_amount
         else:
             return bet_amt, pp_amt, plus3_amt  # Sit out with 0 bets
     else:
-        bet_amt = NORMAL_BET_AMOUNT
-    if COUNT_THE_PP_SIDE_BET:
-        pp_ev = get_pp_ev(shoe)
-        if pp_ev > PP_EV_THRESHOLD:
+        bet_amt = config.normal_bet_amount
+    if config.count_the_pp_side_bet:
+        pp_ev = tracker.pp_ev() if tracker is not None else get_pp_ev(shoe)
+        if pp_ev > config.pp_ev_threshold:
             print('\tpp_ev = ' + str(pp_ev))
-            pp_ev = bet_amt
-    if COUNT_THE_PLUS3_SIDE_BET:
-        plus3_ev = get_plus3_ev(shoe)
-        if plus3_ev > PLUS3_EV_THRESHOLD:
+            pp_amt = bet_amt
+    if config.count_the_plus3_side_bet:
+        plus3_ev = tracker.plus3_ev() if tracker is not None else get_plus3_ev(shoe)
+        if plus3_ev > config.plus3_ev_threshold:
             print('\tplus3_ev = ' + str(plus3_ev))
-            plus3_ev = bet_amt
+            plus3_amt = bet_amt
     return bet_amt, pp_amt, plus3_amt
 
-def main():
-    SHOES_TO_PLAY = 50
+def plot_bankroll(pnls, path):
+    # matplotlib is slow to import, so only pull it in when a chart is asked for
+    import matplotlib
+    matplotlib.use('Agg')  # Write straight to file, no display needed
+    import matplotlib.pyplot as plt
+    bankroll = [STARTING_BANKROLL]
+    for pnl in pnls:
+        bankroll.append(bankroll[-1] + pnl)
+    fig, ax = plt.subplots()
+    ax.plot(range(0,len(bankroll)), bankroll)
+    ax.set_xlabel('Shoes played')
+    ax.set_ylabel('Bankroll')
+    fig.savefig(path)
+    plt.close(fig)
+
+def profile_import(module='blackjack'):
+    # Cold-start import cost in a fresh interpreter, per `python -X importtime`.
+    # Returns the module's cumulative import time in ms and its slowest imports.
+    import subprocess
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=here, capture_output=True, text=True, check=True)
+    timings = []
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue  # Header line
+        timings.append((int(fields[1]) / 1000.0, fields[2].rstrip()))
+    total_ms = [ms for ms, name in timings if name.strip() == module][-1]
+    # Only direct imports of the module, nested ones are already in their cumulative time
+    depth = min(len(name) - len(name.lstrip()) for ms, name in timings)
+    top_level = [(ms, name.strip()) for ms, name in timings if len(name) - len(name.lstrip()) == depth + 2]
+    return total_ms, sorted(top_level, reverse=True)[:5]
+
+def print_stats(shoe_stats):
+    print('Shoes = ' + str(shoe_stats.n))
+    print('EV per shoe = ' + str(round(shoe_stats.mean, 2)) + ' +/- ' + str(round(shoe_stats.half_width(), 2)) + ' (95%)')
+    print('SD per shoe = ' + str(round(shoe_stats.stdev(), 2)))
+    print('Risk of ruin = ' + str(round(shoe_stats.risk_of_ruin(STARTING_BANKROLL), 4)))
+    print('N0 = ' + str(round(shoe_stats.n0(), 1)) + ' shoes')
+
+def main(argv=None):
+    # Imported here rather than at the top so worker processes don't pay for it
+    import argparse
+    parser = argparse.ArgumentParser(description='Simulate online live dealer blackjack')
+    parser.add_argument('--shoes', type=int, default=SHOES_TO_PLAY, help='number of shoes to play')
+    parser.add_argument('--precision', type=float, metavar='PNL',
+                        help='instead of --shoes, play until the 95%% interval for pnl per shoe is within +/- PNL')
+    parser.add_argument('--max-shoes', type=int, help='with --precision, stop after this many shoes regardless')
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per core)')
+    parser.add_argument('--seed', type=int, help='master seed for reproducible runs')
+    parser.add_argument('--chunk-size', type=int, help='shoes per worker task')
+    parser.add_argument('--replay', type=int, metavar='SHOE', help='replay one shoe of a --seed run and exit')
+    parser.add_argument('--library', metavar='PATH',
+                        help='play the first --shoes shoes of a shoelib library instead of shuffling')
+    parser.add_argument('--engine', choices=['scalar', 'batch'], default='scalar',
+                        help='batch plays every shoe at once with NumPy, in this process')
+    parser.add_argument('--score-systems', action='store_true',
+                        help='score every counting system on the same shoes with the batch engine and exit')
+    parser.add_argument('--log', metavar='PATH', help='append every round to the event log at PATH (runs in this process)')
+    parser.add_argument('--instrument', action='store_true',
+                        help='count and time the hot paths and print a summary (runs in this process)')
+    parser.add_argument('--sample-profile', metavar='PATH',
+                        help='save sampled stacks to PATH in collapsed flame graph format (runs in this process)')
+    parser.add_argument('--plot', metavar='PATH', help='save a bankroll chart to PATH')
+    parser.add_argument('--profile-import', action='store_true', help='report cold-start import time and exit')
+    parser.add_argument('--import-budget-ms', type=float, help='with --profile-import, fail if import takes longer')
+    args = parser.parse_args(argv)
+
+    if args.profile_import:
+        total_ms, slowest = profile_import()
+        print('Import blackjack = ' + str(round(total_ms, 1)) + ' ms')
+        for ms, name in slowest:
+            print('\t' + name + ' = ' + str(round(ms, 1)) + ' ms')
+        if args.import_budget_ms is not None and total_ms > args.import_budget_ms:
+            print('Over budget of ' + str(args.import_budget_ms) + ' ms')
+            return 1
+        return 0
+
+    if args.replay is not None:
+        if args.seed is None:
+            parser.error('--replay needs the --seed of the run')
+        pnl = play(runner.get_shoe_rng(args.seed, args.replay))
+        print('Shoe ' + str(args.replay) + ' of seed ' + str(args.seed) + ' = ' + str(pnl))
+        return 0
+
+    seed = runner.get_master_seed(args.seed)
+    if args.library:
+        import shoelib
+        cards_per_shoe, seed, library_shoes = shoelib.read_header(args.library)
+        if args.shoes > library_shoes:
+            print('Only ' + str(library_shoes) + ' shoes in ' + args.library + ', playing those', file=sys.stderr)
+            args.shoes = library_shoes
+    def run_shoes(play_shoe, workers):
+        if args.library:
+            return runner.run_library(play_shoe, args.library, args.shoes, workers, args.chunk_size)
+        return runner.run_shoes(play_shoe, args.shoes, workers, seed, args.chunk_size)
+    def get_shoes():
+        if args.library:
+            return shoelib.get_library(args.library)[:args.shoes]
+        return runner.shuffle_shoes(fill_shoe(DECKS_PER_SHOE).cards, args.shoes, seed)
+
+    if args.score_systems:
+        import blackjack_batch
+        shoes = get_shoes()
+        scores = blackjack_batch.score_counting_systems(shoes)
+        print('Seed = ' + str(seed))
+        for system, system_scores in zip(COUNTING_SYSTEMS, scores.T):
+            system_stats = stats.RunningStats()
+            for pnl in system_scores.tolist():
+                system_stats.add(pnl)
+            print(system + ' EV per shoe = ' + str(round(system_stats.mean, 2)) + ' +/- ' +
+                  str(round(system_stats.half_width(), 2)) + ' (95%)')
+        return 0
+
+    if args.precision is not None:
+        if args.engine == 'batch' or args.log or args.plot or args.library:
+            parser.error('--precision only works with the scalar engine, without --log, --plot or --library')
+        shoe_stats = runner.run_until(play, args.precision, args.workers, seed, args.chunk_size, max_shoes=args.max_shoes)
+        print('Seed = ' + str(seed))
+        print_stats(shoe_stats)
+        return 0
+
+    if args.engine == 'batch' and (args.log or args.instrument):
+        parser.error('--log and --instrument only work with the scalar engine')
+    with contextlib.ExitStack() as stack:
+        workers = args.workers
+        if args.instrument or args.sample_profile:
+            import instrument
+            workers = 1  # Instrumentation only sees this process
+            if args.instrument:
+                instruments = stack.enter_context(instrument.Instruments(sys.modules[__name__]))
+            if args.sample_profile:
+                profiler = stack.enter_context(instrument.SamplingProfiler())
+        if args.engine == 'batch':
+            import blackjack_batch
+            pnls = blackjack_batch.play_shuffled_shoes(get_shoes()).tolist()
+        elif args.log:
+            import eventlog
+            with eventlog.RoundRecorder(args.log) as recorder:
+                pnls = run_shoes(functools.partial(play, recorder=recorder), 1)
+        else:
+            pnls = run_shoes(play, workers)
+    print('Seed = ' + str(seed))
     bankroll = STARTING_BANKROLL
-    for i in range(0,SHOES_TO_PLAY):
-        pnl = play()
+    for pnl in pnls:
         bankroll += pnl
     print('Bankroll start = ' + str(STARTING_BANKROLL))
     print('Bankroll end = ' + str(bankroll))
-    print('Profit ' + str(bankroll - STARTING_BANKROLL) + ' over ' + str(SHOES_TO_PLAY) + ' shoes')
+    print('Profit ' + str(bankroll - STARTING_BANKROLL) + ' over ' + str(args.shoes) + ' shoes')
+    shoe_stats = stats.RunningStats()
+    for pnl in pnls:
+        shoe_stats.add(pnl)
+    print_stats(shoe_stats)
+    if args.instrument:
+        print(instruments.summary())
+    if args.sample_profile:
+        profiler.save(args.sample_profile)
+    if args.plot:
+        plot_bankroll(pnls, args.plot)
+    return 0
 
 if __name__=='__main__':
-    main()
+    sys.exit(main())
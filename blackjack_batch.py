@@ -0,0 +1,374 @@
+"""
+blackjack_batch.py
+
+Plays many blackjack shoes in lock-step with NumPy, one round per shoe per pass
+"""
+
+from array import array
+
+import numpy as np
+
+import blackjack
+import runner
+
+STAND = 0
+HIT = 1
+DOUBLE = 2
+SURRENDER = 3
+DECISION_CODES = {'stand': STAND, 'hit': HIT, 'double': DOUBLE, 'surrender': SURRENDER,
+                  None: STAND}  # None only fills totals a hand can't have
+
+# Same lookup tables as blackjack.py, indexed by card code
+CARD_HARD_VALUES = np.array(blackjack.CARD_HARD_VALUES, dtype=np.int16)
+CARD_VALUES = np.array(blackjack.CARD_VALUES, dtype=np.int16)
+CARD_IS_ACE = np.array([rank == 'A' for rank in blackjack.CARD_RANKS])
+CARD_IS_TEN = np.array([rank in 'TJQK' for rank in blackjack.CARD_RANKS])
+CARD_RANK_CODES = np.arange(52) % 13
+
+def get_strategy_arrays(name):
+    # blackjack.get_compiled_strategy() as arrays, decisions as the codes above
+    splits, plays = blackjack.get_compiled_strategy(name)
+    return np.array(splits, dtype=bool), np.array([DECISION_CODES[play] for play in plays], dtype=np.int8)
+
+def get_other_plays(name):
+    # Decision codes for the other seats, laid out like get_strategy_arrays()
+    if name == 'DEALER':
+        totals = np.arange(2 * 22 * blackjack.ROW_SIZE) // blackjack.ROW_SIZE % 22
+        return np.where(totals < 17, HIT, STAND).astype(np.int8)
+    return get_strategy_arrays(name)[1]
+
+def get_totals(hard_total, aces):
+    # Hand.add() for arrays: (total, soft)
+    total = np.where(aces & (hard_total <= 11), hard_total + 10, hard_total)
+    return total, aces & (hard_total <= 10)
+
+def get_count_buckets(true_count):
+    # get_count_bucket() for arrays
+    middle = 2 + np.clip(true_count, 0.0, 6.0).astype(np.intp)
+    return np.where(true_count <= 0.0, np.where(true_count <= -1.0, 0, 1), np.where(true_count >= 6.0, 8, middle))
+
+def get_columns(running_count, pos, n_cards, dealer_up_card, config):
+    # Dealer value and count bucket part of a compiled strategy index
+    true_count = blackjack.get_true_count(running_count, n_cards - pos, config)
+    return CARD_VALUES[dealer_up_card] * blackjack.COUNT_BUCKETS + get_count_buckets(true_count), true_count
+
+def get_side_bet_amounts(compositions, bet_amt, config):
+    # get_bet_amount()'s pp_amt and plus3_amt for each round: the main bet
+    # when the side bet is counted and the yield of the cards left in
+    # compositions, an (n_rounds, 52) array, clears its threshold
+    import sidebets  # It plays its shoes with this module
+    pp_amt = np.zeros(len(bet_amt))
+    plus3_amt = np.zeros(len(bet_amt))
+    if config.count_the_pp_side_bet:
+        pp_amt = np.where(sidebets.get_pp_yields(compositions) > config.pp_ev_threshold, bet_amt, 0.0)
+    if config.count_the_plus3_side_bet:
+        plus3_amt = np.where(sidebets.get_plus3_yields(compositions) > config.plus3_ev_threshold, bet_amt, 0.0)
+    return pp_amt, plus3_amt
+
+def get_cards_between(cards, starts, first, last):
+    # Every card in cards[starts + first:starts + last], end to end, and the
+    # index into starts each one came from
+    lengths = last - first
+    offsets = np.repeat(starts + first - np.cumsum(lengths) + lengths, lengths)
+    return np.repeat(np.arange(len(lengths)), lengths), cards[offsets + np.arange(lengths.sum())]
+
+def remove_cards(composition, cards, rows, starts, first, last):
+    # Takes cards[starts + first:starts + last] out of each row's composition
+    index, dealt = get_cards_between(cards, starts, first, last)
+    np.subtract.at(composition, (rows[index], dealt), 1)
+
+def play_scalar_round(shoe_cards, position, count, bet_amt, cards, config):
+    # The scalar play_round() from just after the deal, for the few rounds
+    # play_rounds() leaves to it. Returns its outcome, count and shoe position.
+    shoe = blackjack.Shoe(0)
+    shoe.cards = array('B', shoe_cards.tobytes())
+    shoe.position = position
+    player_card_1, player_card_2, dealer_up_card, dealer_down_card = [int(card) for card in cards]
+    players_hands = [blackjack.Hand(bet_amt, [player_card_1, player_card_2])]
+    dealer_hand = blackjack.Hand(0, [dealer_up_card, dealer_down_card])
+    outcome, pp_outcome, plus3_outcome, count = blackjack.play_round(shoe, players_hands, dealer_hand, count, bet_amt,
+                                                                     0, 0, config=config)
+    if config.number_of_other_players:
+        dealer_hand, count = blackjack.finish_dealer_hand(dealer_hand, shoe, count, config=config)
+    return outcome, count, shoe.position
+
+def play_hands(cards, starts, index, pos, running_count, hard_total, aces, column, bet_amt, plays, tags):
+    # Plays one hand for each round in index from its first two cards, like
+    # play_round() once the hand isn't split. pos and running_count are the
+    # round arrays and are updated in place, the rest line up with index.
+    # Returns each hand's total and bet.
+    total, soft = get_totals(hard_total, aces)
+    hand_bet_amt = bet_amt.copy()
+    acting = np.ones(len(index), dtype=bool)
+    first_action = True
+    while acting.any():
+        hands = np.flatnonzero(acting)
+        decision = plays[(soft[hands] * 22 + total[hands]) * blackjack.ROW_SIZE + column[hands]]
+        drawing = decision != STAND
+        if first_action:
+            doubling = hands[decision == DOUBLE]
+            hand_bet_amt[doubling] += bet_amt[doubling]
+            # Halve the bet and score the hand as a bust with a filler ten
+            surrendering = hands[decision == SURRENDER]
+            hand_bet_amt[surrendering] -= bet_amt[surrendering] * 0.5
+            hard_total[surrendering] += 10
+            total[surrendering], soft[surrendering] = get_totals(hard_total[surrendering], aces[surrendering])
+            drawing &= decision != SURRENDER
+            acting[doubling] = False
+            first_action = False
+        acting[hands[~drawing]] = False
+        hands = hands[drawing]
+        rounds = index[hands]
+        next_card = cards[starts[rounds] + pos[rounds]]
+        pos[rounds] += 1
+        running_count[rounds] += tags[next_card]
+        hard_total[hands] += CARD_HARD_VALUES[next_card]
+        aces[hands] |= CARD_IS_ACE[next_card]
+        total[hands], soft[hands] = get_totals(hard_total[hands], aces[hands])
+        acting[hands[total[hands] > 21]] = False
+    return total, hand_bet_amt
+
+def settle_hands(total, bet_amt, dealer_total):
+    # round_outcome() for one hand per round
+    won = (total <= 21) & ((total > dealer_total) | (dealer_total > 21))
+    lost = (total > 21) | ((total < dealer_total) & (dealer_total <= 21))
+    return np.where(won, bet_amt, np.where(lost, -bet_amt, 0.0))
+
+def play_rounds(cards, n_cards, rows, cursor, count, pnl, splits, plays, other_plays, tags, config, composition=None):
+    # One round for each shoe in rows, updating cursor, count and pnl in place
+    # and returning each round's outcome, side bets included.
+    # cards holds every shoe end to end, n_cards apiece. composition is each
+    # shoe's count of every card code left, updated in place, or None when
+    # config counts neither side bet.
+    # Splits are played here with one split per round. Rounds that resplit or
+    # make 21 on a split hand are replayed with the scalar play_round().
+    n_rounds = len(rows)
+    everything = np.arange(n_rounds)
+    starts = rows * n_cards  # Where each round's shoe begins in cards
+    pos = cursor[rows]
+    running_count = count[rows]
+
+    # get_bet_amount()
+    bet_amt = np.full(n_rounds, float(config.normal_bet_amount))
+    if config.bet_only_when_favorable_count:
+        bet_amt[~blackjack.is_favorable_count(running_count, n_cards - pos, config)] = 0.0
+    if composition is not None:
+        pp_amt, plus3_amt = get_side_bet_amounts(composition[rows], bet_amt, config)
+
+    # deal_round(), the other seats first
+    other_seats = config.number_of_other_players
+    dealt = cards[(starts + pos)[:, None] + np.arange(2 * other_seats + 4)]
+    for card in dealt.T[:-1]:
+        running_count = running_count + tags[card]
+    pos = pos + dealt.shape[1]
+    other_cards, dealt = dealt[:, :-4], dealt[:, -4:]
+    player_card_1, player_card_2, dealer_up_card, dealer_down_card = dealt.T
+    dealer_has_bj = ((CARD_IS_ACE[dealer_up_card] & CARD_IS_TEN[dealer_down_card]) |
+                     (CARD_IS_ACE[dealer_down_card] & CARD_IS_TEN[dealer_up_card]))
+    if composition is not None:
+        # Perfect Pair on our two cards, 21+3 with the dealer's up card too
+        import sidebets
+        side_bet_outcome = (pp_amt * sidebets.get_pp_payouts(dealt[:, :2]) +
+                            plus3_amt * sidebets.get_plus3_payouts(dealt[:, :3]))
+
+    # play_other_hands(), at a true count of 0
+    index = everything[~dealer_has_bj]
+    other_column = CARD_VALUES[dealer_up_card[index]] * blackjack.COUNT_BUCKETS + blackjack.get_count_bucket(0.0)
+    for seat in range(0,other_seats):
+        card_1, card_2 = other_cards[index, 2 * seat], other_cards[index, 2 * seat + 1]
+        play_hands(cards, starts, index, pos, running_count, CARD_HARD_VALUES[card_1] + CARD_HARD_VALUES[card_2],
+                   CARD_IS_ACE[card_1] | CARD_IS_ACE[card_2], other_column, np.zeros(len(index)), other_plays, tags)
+    dealt_pos = pos.copy()
+    dealt_count = running_count.copy()
+
+    column, true_count = get_columns(running_count, pos, n_cards, dealer_up_card, config)
+    hard_total = CARD_HARD_VALUES[player_card_1] + CARD_HARD_VALUES[player_card_2]
+    aces = CARD_IS_ACE[player_card_1] | CARD_IS_ACE[player_card_2]
+    total = get_totals(hard_total, aces)[0]
+
+    insurance = CARD_IS_ACE[dealer_up_card] & (true_count >= 3.0)
+    player_has_bj = total == 21
+    outcome = np.where(insurance, np.where(player_has_bj, bet_amt, 0.0),
+                       np.where(dealer_has_bj, np.where(player_has_bj, 0.0, -bet_amt), bet_amt * config.blackjack_payout))
+    live = ~(player_has_bj | dealer_has_bj)
+    outcome[live] = np.where(insurance[live], -(bet_amt[live] / 2.0), 0.0)
+
+    pair = CARD_RANK_CODES[player_card_1] == CARD_RANK_CODES[player_card_2]
+    split = live & pair & splits[CARD_VALUES[player_card_1] * blackjack.ROW_SIZE + column]
+
+    # Hands that aren't split
+    first_total = total.copy()
+    first_bet_amt = bet_amt.copy()
+    index = everything[live & ~split]
+    first_total[index], first_bet_amt[index] = play_hands(cards, starts, index, pos, running_count, hard_total[index],
+                                                          aces[index], column[index], bet_amt[index], plays, tags)
+
+    # Split hands, each pair card gets its second card before either is played
+    index = everything[split]
+    second_total = np.zeros(n_rounds, dtype=total.dtype)
+    second_bet_amt = np.zeros(n_rounds)
+    second_bet_amt[index] = bet_amt[index]
+    split_cards = []
+    for pair_card in (player_card_1[index], player_card_2[index]):
+        next_card = cards[starts[index] + pos[index]]
+        pos[index] += 1
+        running_count[index] += tags[next_card]
+        split_cards.append((pair_card, next_card))
+    replay = np.zeros(n_rounds, dtype=bool)
+    playing = ~CARD_IS_ACE[player_card_1[index]] | config.hit_split_aces  # Split aces get one card each
+    for (pair_card, next_card), hand_total, hand_bet_amt in zip(split_cards, (first_total, second_total),
+                                                                 (first_bet_amt, second_bet_amt)):
+        hand_hard_total = CARD_HARD_VALUES[pair_card] + CARD_HARD_VALUES[next_card]
+        hand_aces = CARD_IS_ACE[pair_card] | CARD_IS_ACE[next_card]
+        hand_total[index] = get_totals(hand_hard_total, hand_aces)[0]
+        playing &= ~replay[index]
+        rounds = index[playing]
+        hand_column, true_count = get_columns(running_count[rounds], pos[rounds], n_cards, dealer_up_card[rounds],
+                                               config)
+        resplit = (CARD_RANK_CODES[pair_card[playing]] == CARD_RANK_CODES[next_card[playing]]) & splits[
+            CARD_VALUES[pair_card[playing]] * blackjack.ROW_SIZE + hand_column]
+        played = ~resplit & (hand_total[rounds] != 21)
+        replay[rounds[~played]] = True
+        rounds = rounds[played]
+        # Insurance is offered again on each split hand
+        outcome[rounds] -= np.where(CARD_IS_ACE[dealer_up_card[rounds]] & (true_count[played] >= 3.0),
+                                    bet_amt[rounds] / 2.0, 0.0)
+        hand_total[rounds], hand_bet_amt[rounds] = play_hands(cards, starts, rounds, pos, running_count,
+                                                              hand_hard_total[playing][played], hand_aces[playing][played],
+                                                              hand_column[played], bet_amt[rounds], plays, tags)
+
+    # play_dealer_hand(). Early returns count the hole card too.
+    running_count += tags[dealer_down_card]
+    settling = live & ~replay
+    # With other seats the dealer plays out even when our hand was settled on the deal
+    dealing = ~dealer_has_bj & ~replay if other_seats else settling
+    dealer_hard_total = CARD_HARD_VALUES[dealer_up_card] + CARD_HARD_VALUES[dealer_down_card]
+    dealer_aces = CARD_IS_ACE[dealer_up_card] | CARD_IS_ACE[dealer_down_card]
+    dealer_total = get_totals(dealer_hard_total, dealer_aces)[0]
+    drawing = dealing & (dealer_total < 17)
+    while drawing.any():
+        index = np.flatnonzero(drawing)
+        next_card = cards[starts[index] + pos[index]]
+        pos[index] += 1
+        running_count[index] += tags[next_card]
+        dealer_hard_total[index] += CARD_HARD_VALUES[next_card]
+        dealer_aces[index] |= CARD_IS_ACE[next_card]
+        dealer_total[index] = get_totals(dealer_hard_total[index], dealer_aces[index])[0]
+        drawing[index[dealer_total[index] >= 17]] = False
+
+    outcome[settling] += (settle_hands(first_total, first_bet_amt, dealer_total) +
+                          settle_hands(second_total, second_bet_amt, dealer_total))[settling]
+
+    for i in np.flatnonzero(replay):
+        shoe_cards = cards[starts[i]:starts[i] + n_cards]
+        outcome[i], running_count[i], pos[i] = play_scalar_round(shoe_cards, int(dealt_pos[i]), float(dealt_count[i]),
+                                                                 bet_amt[i].item(), dealt[i], config)
+
+    if composition is not None:
+        outcome += side_bet_outcome
+        remove_cards(composition, cards, rows, starts, cursor[rows], pos)
+    cursor[rows] = pos
+    count[rows] = running_count
+    pnl[rows] += outcome
+    return outcome
+
+def play_passes(shoes, config):
+    # Plays every shoe in shoes, an (n_shoes, cards) array of card codes in
+    # dealing order, like blackjack.play(), a round per shoe per pass. Yields
+    # each pass's (rows, pos, outcome): the shoes that played a round, where in
+    # the shoe their round began and what it won, side bets included. OPTIMAL
+    # and ev_mode are scalar only.
+    if config.strategy not in blackjack.STRATEGIES or config.ev_mode:
+        raise ValueError('the batch engine plays the STRATEGIES tables without ev_mode')
+    splits, plays = get_strategy_arrays(config.strategy)
+    other_plays = get_other_plays(config.other_players_strategy)
+    tags = np.array(blackjack.COUNT_TAGS[config.card_counting_system])
+    n_shoes, n_cards = shoes.shape
+    cards = np.ascontiguousarray(shoes).reshape(-1)
+    cursor = np.zeros(n_shoes, dtype=np.intp)
+    count = np.full(n_shoes, blackjack.get_initial_count(config.card_counting_system, n_cards // 52))
+    pnl = np.zeros(n_shoes)
+    rows = np.arange(n_shoes)
+    composition = None
+    if config.count_the_pp_side_bet or config.count_the_plus3_side_bet:
+        composition = np.bincount((rows[:, None] * 52 + shoes).reshape(-1), minlength=n_shoes * 52).reshape(n_shoes, 52)
+    active = rows
+    while len(active) > 0:
+        pos = cursor[active]
+        outcome = play_rounds(cards, n_cards, active, cursor, count, pnl, splits, plays, other_plays, tags, config,
+                              composition)
+        yield active, pos, outcome
+        active = rows[(n_cards - cursor) / n_cards > 1 - config.penetration]
+
+def play_shuffled_shoes(shoes, config=None):
+    # Every shoe's pnl, config defaulting to blackjack.get_config()
+    if config is None:
+        config = blackjack.get_config()
+    pnl = np.zeros(len(shoes))
+    for rows, pos, outcome in play_passes(shoes, config):
+        pnl[rows] += outcome
+    return pnl
+
+def get_round_outcomes(shoes, config=None):
+    # An (n_shoes, most rounds in a shoe) array of every round's outcome, in
+    # the order each shoe played them. Rounds after a shoe ends are 0.
+    if config is None:
+        config = blackjack.get_config()
+    passes = [(rows, outcome) for rows, pos, outcome in play_passes(shoes, config)]
+    outcomes = np.zeros((len(shoes), len(passes)))
+    for round_index, (rows, outcome) in enumerate(passes):
+        outcomes[rows, round_index] = outcome
+    return outcomes
+
+def get_system_counts(shoes, systems):
+    # Every system's running count before each card of each shoe, in one pass:
+    # an (n_shoes, cards + 1, len(systems)) array, [:, i] counting cards[:i]
+    # from the system's initial count. That's about 3 KB a system per 8-deck
+    # shoe, so pass shoes in chunks.
+    tags = np.array([blackjack.COUNT_TAGS[system] for system in systems]).T
+    counts = np.zeros((shoes.shape[0], shoes.shape[1] + 1, len(systems)))
+    np.cumsum(tags[shoes], axis=1, out=counts[:, 1:])
+    counts += [blackjack.get_initial_count(system, shoes.shape[1] // 52) for system in systems]
+    return counts
+
+def score_counting_systems(shoes, systems=None, config=None):
+    # Plays each shoe once, config's counting system choosing the strategy
+    # deviations, and scores every system in systems (default all of
+    # blackjack.COUNTING_SYSTEMS) on the same rounds: what the main bet would
+    # have won had that system's count decided when to bet, each at its own
+    # threshold or key count (see blackjack.is_favorable_count). Returns an
+    # (n_shoes, len(systems)) array of pnl.
+    if config is None:
+        config = blackjack.get_config()
+    if systems is None:
+        systems = blackjack.COUNTING_SYSTEMS
+    # Main bet outcomes per unit bet
+    unit_config = config._replace(normal_bet_amount=1, bet_only_when_favorable_count=False,
+                                  count_the_pp_side_bet=False, count_the_plus3_side_bet=False)
+    n_cards = shoes.shape[1]
+    cards = np.ascontiguousarray(shoes).reshape(-1)
+    tags = np.array([blackjack.COUNT_TAGS[system] for system in systems]).T
+    # Every system's running count, brought up to each round's start a pass at a time
+    system_counts = np.tile([blackjack.get_initial_count(system, n_cards // 52) for system in systems], (len(shoes), 1))
+    counted = np.zeros(len(shoes), dtype=np.intp)
+    scores = np.zeros((len(shoes), len(systems)))
+    for rows, pos, outcome in play_passes(shoes, unit_config):
+        index, dealt = get_cards_between(cards, rows * n_cards, counted[rows], pos)
+        np.add.at(system_counts, rows[index], tags[dealt])
+        counted[rows] = pos
+        bet_amt = np.full((len(rows), len(systems)), float(config.normal_bet_amount))
+        if config.bet_only_when_favorable_count:
+            for i, system in enumerate(systems):
+                bet_amt[~blackjack.is_favorable_count(system_counts[rows, i], n_cards - pos, config, system), i] = 0.0
+        scores[rows] += bet_amt * outcome[:, None]
+    return scores
+
+def play_shoes(n_shoes, seed=None, first_shoe=0, config=None):
+    # Plays shoes first_shoe to first_shoe + n_shoes of a seed run with
+    # play_shuffled_shoes(). Shoe i is the same shoe
+    # runner.run_shoes(blackjack.play, ...) deals for that seed.
+    if config is None:
+        config = blackjack.get_config()
+    shoe = blackjack.fill_shoe(config.decks_per_shoe)
+    shoes = runner.shuffle_shoes(shoe.cards, n_shoes, runner.get_master_seed(seed), first_shoe)
+    return play_shuffled_shoes(shoes, config)
@@ -0,0 +1,128 @@
+"""
+eventlog.py
+
+Append-only binary log of every blackjack round, read back with numpy.memmap
+"""
+
+import os
+import struct
+
+# Decisions made during a round, OR'd together into a record's actions
+HIT = 1
+DOUBLE = 2
+SPLIT = 4
+SURRENDER = 8
+BLACKJACK = 16
+INSURANCE = 32
+DECISION_BITS = {'stand': 0, 'hit': HIT, 'double': DOUBLE, 'split': SPLIT, 'surrender': SURRENDER, 'blackjack': BLACKJACK}
+
+# One fixed-width little-endian record per round, no padding, so the file is
+# an array of RECORD_FIELDS after the header
+RECORD_FIELDS = [('shoe', 'I'), ('round', 'H'), ('true_count', 'f'), ('bet_amt', 'f'), ('pp_amt', 'f'),
+                 ('plus3_amt', 'f'), ('actions', 'B'), ('outcome', 'f'), ('pp_outcome', 'f'),
+                 ('plus3_outcome', 'f'), ('cards_used', 'B')]
+RECORD = struct.Struct('<' + ''.join(code for name, code in RECORD_FIELDS))
+HEADER = b'LDCSRND1' + struct.pack('<I', RECORD.size)
+BUFFER_ROUNDS = 65536  # Rounds held in memory before they're written out
+
+NUMPY_CODES = {'I': '<u4', 'H': '<u2', 'B': 'u1', 'f': '<f4'}
+
+def get_record_dtype():
+    import numpy as np
+    return np.dtype([(name, NUMPY_CODES[code]) for name, code in RECORD_FIELDS])
+
+class RoundRecorder:
+    # Buffers round records and appends them to path a buffer at a time, so
+    # memory stays at buffer_rounds records however long the run.
+    # blackjack.play() calls start_shoe() once per shoe, play_round() calls
+    # add_decision() for each decision, then play() calls record_round().
+
+    def __init__(self, path, buffer_rounds=BUFFER_ROUNDS):
+        self.path = path
+        self.file = open(path, 'ab')
+        self.shoe = -1  # Shoe numbers carry on from the records already in the file
+        size = self.file.tell()
+        if size == 0:
+            self.file.write(HEADER)
+        else:
+            with open(path, 'rb') as existing:
+                if existing.read(len(HEADER)) != HEADER:
+                    self.file.close()
+                    raise ValueError(path + ' is not a round log with this record layout')
+                # Drop a record cut short by a crash so new ones line up
+                size -= (size - len(HEADER)) % RECORD.size
+                self.file.truncate(size)
+                if size > len(HEADER):
+                    existing.seek(size - RECORD.size)
+                    self.shoe = RECORD.unpack(existing.read(RECORD.size))[0]
+        self.buffer = bytearray(RECORD.size * buffer_rounds)
+        self.buffered = 0
+        self.round = 0
+        self.actions = 0
+
+    def start_shoe(self):
+        self.shoe += 1
+        self.round = 0
+
+    def add_decision(self, decision, insurance):
+        self.actions |= DECISION_BITS[decision] | (INSURANCE if insurance else 0)
+
+    def record_round(self, true_count, bet_amt, pp_amt, plus3_amt, outcome, pp_outcome, plus3_outcome, cards_used):
+        RECORD.pack_into(self.buffer, self.buffered * RECORD.size, self.shoe, self.round, true_count, bet_amt,
+                         pp_amt, plus3_amt, self.actions, outcome, pp_outcome, plus3_outcome, cards_used)
+        self.round += 1
+        self.actions = 0
+        self.buffered += 1
+        if self.buffered * RECORD.size == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        self.file.write(memoryview(self.buffer)[:self.buffered * RECORD.size])
+        self.file.flush()
+        self.buffered = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def read_rounds(path):
+    # Every complete record in a log as a read-only structured memmap, so
+    # columns like rounds['outcome'] are views into the file. A record cut
+    # short by a crash mid-write is left off.
+    import numpy as np
+    with open(path, 'rb') as log:
+        if log.read(len(HEADER)) != HEADER:
+            raise ValueError(path + ' is not a round log with this record layout')
+    dtype = get_record_dtype()
+    n_rounds = (os.path.getsize(path) - len(HEADER)) // dtype.itemsize
+    if n_rounds == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=len(HEADER), shape=(n_rounds,))
+
+def export_parquet(path, parquet_path, rows_per_group=1 << 20):
+    # Copies a log into a Parquet file, one row group per rows_per_group
+    # rounds (one empty group for an empty log). Needs pyarrow.
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('export_parquet needs pyarrow (pip install pyarrow)')
+    rounds = read_rounds(path)
+    writer = None
+    try:
+        for start in range(0, max(len(rounds), 1), rows_per_group):
+            group = rounds[start:start + rows_per_group]
+            table = pyarrow.table({name: group[name] for name, code in RECORD_FIELDS})
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(parquet_path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
@@ -0,0 +1,190 @@
+"""
+instrument.py
+
+Opt-in counters, phase timers and a sampling profiler for blackjack runs
+"""
+
+import collections
+import os
+import signal
+import time
+
+# Nothing in blackjack.py checks for instrumentation. Instruments swaps the
+# module's functions for counting and timing wrappers while it's enabled and
+# puts the originals back after, so runs without it pay nothing. Everything
+# goes through module globals, so only shoes played in this process are seen.
+
+PHASES = ['deal_round', 'play_round', 'play_dealer_hand', 'side-bet EV']
+COUNTERS = ['shoes', 'rounds', 'rounds sat out', 'cards drawn', 'splits', 'doubles', 'surrenders',
+            'side-bet EV evaluations']
+SIDE_BET_EV_FUNCTIONS = ['get_pp_ev', 'get_plus3_ev']
+SIDE_BET_EV_METHODS = ['pp_ev', 'plus3_ev']
+
+class Instruments:
+    # with Instruments() as instruments: play shoes, then print
+    # instruments.summary(). Timers are inclusive, so play_round's time
+    # includes play_dealer_hand's. module is the blackjack module to
+    # instrument, which is __main__ when blackjack.py is run as a script.
+
+    def __init__(self, module=None):
+        if module is None:
+            import blackjack as module
+        self.module = module
+        self.counters = collections.Counter()
+        self.calls = collections.Counter()
+        self.timers = collections.defaultdict(float)
+        self.pending = collections.Counter()  # Decisions in the round being played
+        self.seconds = 0.0  # Wall time spent enabled
+        self.saved = []
+        self.started = None
+
+    def timed(self, phase, function):
+        timers = self.timers
+        calls = self.calls
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timers[phase] += time.perf_counter() - start
+                calls[phase] += 1
+        return wrapper
+
+    def counted_decisions(self, function, round_count_index):
+        # Splits, and doubles and surrenders on the first two cards; later
+        # ones are played as hits. They're held until the round is settled,
+        # see counted_rounds.
+        pending = self.pending
+        def wrapper(*args, **kwargs):
+            decision, insurance = function(*args, **kwargs)
+            if decision == 'split':
+                pending['splits'] += 1
+            elif decision in ('double', 'surrender'):
+                round_count = args[round_count_index] if len(args) > round_count_index else kwargs['round_count']
+                if round_count == 0:
+                    pending[decision + 's'] += 1
+            return decision, insurance
+        return wrapper
+
+    def counted_rounds(self, function):
+        # play_round() settles a dealer blackjack before acting on the first
+        # decision, so that round's decisions weren't taken
+        pending = self.pending
+        counters = self.counters
+        card_values = self.module.CARD_VALUES
+        def wrapper(*args, **kwargs):
+            pending.clear()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                dealer_hand = args[2] if len(args) > 2 else kwargs['dealer_hand']
+                if card_values[dealer_hand.cards[0]] + card_values[dealer_hand.cards[1]] != 21:
+                    counters.update(pending)
+                pending.clear()
+        return wrapper
+
+    def replace(self, owner, name, wrapper):
+        self.saved.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, wrapper)
+
+    def enable(self):
+        if self.saved:
+            return
+        counters = self.counters
+        blackjack = self.module
+        play = blackjack.play
+        def counted_play(*args, **kwargs):
+            counters['shoes'] += 1
+            return play(*args, **kwargs)
+        self.replace(blackjack, 'play', counted_play)
+        get_card = blackjack.get_card
+        def counted_get_card(shoe):
+            counters['cards drawn'] += 1
+            return get_card(shoe)
+        self.replace(blackjack, 'get_card', counted_get_card)
+        get_bet_amount = blackjack.get_bet_amount
+        def counted_get_bet_amount(*args, **kwargs):
+            amounts = get_bet_amount(*args, **kwargs)
+            counters['rounds'] += 1
+            if amounts[0] == 0:
+                counters['rounds sat out'] += 1
+            return amounts
+        self.replace(blackjack, 'get_bet_amount', counted_get_bet_amount)
+        self.replace(blackjack, 'get_decision', self.counted_decisions(blackjack.get_decision, 4))
+        self.replace(blackjack, 'get_optimal_decision', self.counted_decisions(blackjack.get_optimal_decision, 5))
+        for phase in ('deal_round', 'play_round', 'play_dealer_hand'):
+            self.replace(blackjack, phase, self.timed(phase, getattr(blackjack, phase)))
+        self.replace(blackjack, 'play_round', self.counted_rounds(blackjack.play_round))
+        for name in SIDE_BET_EV_FUNCTIONS:
+            self.replace(blackjack, name, self.timed('side-bet EV', getattr(blackjack, name)))
+        for name in SIDE_BET_EV_METHODS:
+            self.replace(blackjack.SideBetTracker, name, self.timed('side-bet EV', getattr(blackjack.SideBetTracker, name)))
+        self.started = time.perf_counter()
+
+    def disable(self):
+        if not self.saved:
+            return
+        self.seconds += time.perf_counter() - self.started
+        for owner, name, original in reversed(self.saved):
+            setattr(owner, name, original)
+        self.saved = []
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def summary(self):
+        self.counters['side-bet EV evaluations'] = self.calls['side-bet EV']
+        lines = [name[0].upper() + name[1:] + ' = ' + str(self.counters[name]) for name in COUNTERS]
+        if self.seconds > 0.0:
+            lines.append('Cards per second = ' + str(round(self.counters['cards drawn'] / self.seconds)))
+        lines.append('Wall time = ' + str(round(self.seconds, 3)) + ' s')
+        for phase in PHASES:
+            if self.calls[phase]:
+                seconds = self.timers[phase]
+                lines.append('\t' + phase + ' = ' + str(round(seconds, 3)) + ' s (' +
+                             str(round(100.0 * seconds / self.seconds, 1)) + '%), ' +
+                             str(round(1e6 * seconds / self.calls[phase], 2)) + ' us per call')
+        return '\n'.join(lines)
+
+class SamplingProfiler:
+    # Samples the main thread's stack every interval seconds of CPU time with
+    # a profiling timer signal (Unix only). Much cheaper than cProfile on code
+    # this call-heavy, and save() writes collapsed stacks ("a;b;c count"
+    # lines) that flamegraph.pl and speedscope read.
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.previous_handler = None
+
+    def sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(code.co_name + ' (' + os.path.basename(code.co_filename) + ':' + str(code.co_firstlineno) + ')')
+            frame = frame.f_back
+        self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self.previous_handler = signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0.0)
+        signal.signal(signal.SIGPROF, self.previous_handler)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def save(self, path):
+        with open(path, 'w') as collapsed:
+            for stack, count in self.samples.most_common():
+                collapsed.write(stack + ' ' + str(count) + '\n')
@@ -0,0 +1,133 @@
+"""
+runner.py
+
+Plays independent shoes across a pool of worker processes
+"""
+
+import concurrent.futures
+import functools
+import os
+
+import stats
+
+# Every shoe of a run gets its own generator, derived from the run's master
+# seed and the shoe's index the same way SeedSequence(seed).spawn() would. Any
+# shoe can be replayed on its own, and two strategies run with the same seed
+# see the same shoes (common random numbers).
+#
+# numpy is imported inside these functions so importing a game stays cheap.
+
+def get_master_seed(seed=None):
+    # An int seed for the run, fresh entropy when seed is None. Print or save
+    # it to replay the run later.
+    if seed is None:
+        import numpy as np
+        return np.random.SeedSequence().entropy
+    return seed
+
+def get_shoe_seed(seed, shoe):
+    # Same as np.random.SeedSequence(seed).spawn(shoe + 1)[shoe]
+    import numpy as np
+    return np.random.SeedSequence(seed, spawn_key=(shoe,))
+
+def get_shoe_rng(seed, shoe):
+    import numpy as np
+    return np.random.default_rng(get_shoe_seed(seed, shoe))
+
+def shuffle_shoes(cards, n_shoes, seed, first_shoe=0):
+    # Returns an (n_shoes, len(cards)) uint8 array, row i shuffled by shoe
+    # first_shoe + i's generator. Each row comes out the same as shuffling
+    # cards in place with rng.shuffle(), like the scalar engines do.
+    import numpy as np
+    shoes = np.tile(np.asarray(cards, dtype=np.uint8), (n_shoes, 1))
+    for i in range(0,n_shoes):
+        get_shoe_rng(seed, first_shoe + i).shuffle(shoes[i])
+    return shoes
+
+def play_common(play_shoes, rng):
+    # Plays the same shoe with every callable in play_shoes by rewinding the
+    # generator before each one
+    state = rng.bit_generator.state
+    results = []
+    for play_shoe in play_shoes:
+        rng.bit_generator.state = state
+        results.append(play_shoe(rng))
+    return tuple(results)
+
+def play_chunk(play_shoe, first_shoe, shoes, seed):
+    return [play_shoe(get_shoe_rng(seed, first_shoe + x)) for x in range(0,shoes)]
+
+def stats_chunk(play_shoe, first_shoe, shoes, seed):
+    # Like play_chunk, but only sends back running stats of the results
+    chunk_stats = stats.RunningStats()
+    for x in range(0,shoes):
+        chunk_stats.add(play_shoe(get_shoe_rng(seed, first_shoe + x)))
+    return chunk_stats
+
+def library_chunk(play_shoe, first_shoe, shoes, path):
+    # play_chunk for shoes from the library at path, played by
+    # play_shoe(cards=row). The library is mapped once per process.
+    import shoelib
+    library = shoelib.get_library(path)
+    return [play_shoe(cards=library[x]) for x in range(first_shoe, first_shoe + shoes)]
+
+def map_chunks(chunk_function, play_shoe, first_shoe, shoes, seed, workers, chunk_size, executor=None):
+    # chunk_function's result for each chunk of shoes, in shoe order
+    if chunk_size is None:
+        chunk_size = max(1, -(-shoes // (workers * 4)))  # ~4 tasks per worker
+    first_shoes = list(range(first_shoe, first_shoe + shoes, chunk_size))
+    chunk_sizes = [min(chunk_size, first_shoe + shoes - start) for start in first_shoes]
+    args = ([play_shoe] * len(chunk_sizes), first_shoes, chunk_sizes, [seed] * len(chunk_sizes))
+    if executor is not None:
+        return list(executor.map(chunk_function, *args))
+    if workers == 1:
+        return list(map(chunk_function, *args))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(chunk_function, *args))
+
+def run_shoes(play_shoe, shoes, workers=None, seed=None, chunk_size=None, first_shoe=0):
+    # Returns play_shoe(rng)'s result for every shoe, in shoe order. rng is
+    # the shoe's own generator, so results only depend on seed, whichever
+    # worker or chunk a shoe lands in.
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunks = map_chunks(play_chunk, play_shoe, first_shoe, shoes, get_master_seed(seed), workers, chunk_size)
+    return [result for chunk in chunks for result in chunk]
+
+def run_library(play_shoe, path, shoes=None, workers=None, chunk_size=None, first_shoe=0):
+    # run_shoes() over shoes first_shoe onwards of a shoelib library, every
+    # shoe by default. The same library gives the same results every time.
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if shoes is None:
+        import shoelib
+        shoes = shoelib.read_header(path)[2] - first_shoe
+    chunks = map_chunks(library_chunk, play_shoe, first_shoe, shoes, path, workers, chunk_size)
+    return [result for chunk in chunks for result in chunk]
+
+def run_until(play_shoe, half_width, workers=None, seed=None, chunk_size=None, batch_shoes=1000, max_shoes=None, z=1.96):
+    # Plays batches of batch_shoes shoes until the confidence interval for
+    # the mean result is within +/- half_width, or max_shoes have been
+    # played. Returns the merged stats.RunningStats of every shoe.
+    if workers is None:
+        workers = os.cpu_count() or 1
+    seed = get_master_seed(seed)
+    total_stats = stats.RunningStats()
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        while total_stats.n < 2 or total_stats.half_width(z) > half_width:
+            shoes = batch_shoes if max_shoes is None else min(batch_shoes, max_shoes - total_stats.n)
+            if shoes <= 0:
+                break
+            for chunk_stats in map_chunks(stats_chunk, play_shoe, total_stats.n, shoes, seed, workers, chunk_size, executor):
+                total_stats.merge(chunk_stats)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return total_stats
+
+def compare_shoes(play_shoes, shoes, workers=None, seed=None, chunk_size=None):
+    # Common random numbers: every callable in play_shoes plays the same
+    # shoes. Returns a tuple of their results per shoe, so differences can be
+    # taken shoe by shoe.
+    return run_shoes(functools.partial(play_common, tuple(play_shoes)), shoes, workers, seed, chunk_size)
@@ -0,0 +1,99 @@
+"""
+shoelib.py
+
+Library of pre-shuffled shoes in one binary file, read back with numpy.memmap
+"""
+
+import os
+import struct
+import sys
+
+import runner
+
+# A header, then one row of card codes (suit * 13 + rank, as in blackjack.py)
+# per shoe. Row i is shoe i of the library's seed, shuffled exactly as
+# runner.get_shoe_rng(seed, i) shuffles it, so a run from the library gets
+# the same results as the same run from the seed. Baccarat maps each code to
+# its rank's value, which gives its own shuffle of the same seed too.
+#
+# Workers open the file with numpy.memmap, so they share the page cache
+# instead of each holding a copy, and nothing is shuffled while playing.
+
+MAGIC = b'LDCSSHOE'
+HEADER = struct.Struct('<8sI16s')  # Magic, cards per shoe, seed as a 128-bit integer
+WRITE_SHOES = 4096  # Shoes shuffled and written at a time
+
+def pack_header(cards_per_shoe, seed):
+    return HEADER.pack(MAGIC, cards_per_shoe, seed.to_bytes(16, 'little'))
+
+def read_header(path):
+    # (cards per shoe, seed, shoes in the file)
+    with open(path, 'rb') as library:
+        magic, cards_per_shoe, seed = HEADER.unpack(library.read(HEADER.size).ljust(HEADER.size, b'\0'))
+    if magic != MAGIC:
+        raise ValueError(path + ' is not a shoe library')
+    shoes = (os.path.getsize(path) - HEADER.size) // cards_per_shoe
+    return cards_per_shoe, int.from_bytes(seed, 'little'), shoes
+
+def get_shoe_cards(decks):
+    import numpy as np
+    return np.tile(np.arange(52, dtype=np.uint8), decks)
+
+def write_library(path, shoes, decks=8, seed=None):
+    # Adds shoes to the library at path, creating it if needed. An existing
+    # library carries on from its last shoe with its own seed, and a shoe cut
+    # short by a crash is shuffled again. Returns the library's seed.
+    cards = get_shoe_cards(decks)
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        cards_per_shoe, seed, first_shoe = read_header(path)
+        if cards_per_shoe != len(cards):
+            raise ValueError(path + ' holds ' + str(cards_per_shoe // 52) + ' deck shoes')
+    else:
+        seed = runner.get_master_seed(seed)
+        first_shoe = 0
+        with open(path, 'wb') as library:
+            library.write(pack_header(len(cards), seed))
+    with open(path, 'r+b') as library:
+        library.truncate(HEADER.size + first_shoe * len(cards))
+        library.seek(0, os.SEEK_END)
+        for start in range(first_shoe, first_shoe + shoes, WRITE_SHOES):
+            count = min(WRITE_SHOES, first_shoe + shoes - start)
+            library.write(runner.shuffle_shoes(cards, count, seed, start).tobytes())
+    open_libraries.pop(os.path.abspath(path), None)  # A map from before now has too few shoes
+    return seed
+
+def read_library(path):
+    # (shoes, seed): shoes is a read-only (n_shoes, cards per shoe) uint8
+    # memmap, so shoes[i] is a view of shoe i in the file
+    import numpy as np
+    cards_per_shoe, seed, shoes = read_header(path)
+    if shoes == 0:
+        return np.zeros((0, cards_per_shoe), dtype=np.uint8), seed
+    return np.memmap(path, dtype=np.uint8, mode='r', offset=HEADER.size, shape=(shoes, cards_per_shoe)), seed
+
+open_libraries = {}
+
+def get_library(path):
+    # read_library(path)[0], mapped once per process until write_library adds
+    # to it
+    key = os.path.abspath(path)
+    if key not in open_libraries:
+        open_libraries[key] = read_library(path)[0]
+    return open_libraries[key]
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Write a library of pre-shuffled shoes')
+    parser.add_argument('path', help='library file, added to if it already exists')
+    parser.add_argument('--shoes', type=int, required=True, help='shoes to add')
+    parser.add_argument('--decks', type=int, default=8, help='decks per shoe for a new library')
+    parser.add_argument('--seed', type=int, help='master seed for a new library')
+    args = parser.parse_args(argv)
+    seed = write_library(args.path, args.shoes, args.decks, args.seed)
+    cards_per_shoe, seed, shoes = read_header(args.path)
+    print('Seed = ' + str(seed))
+    print('Shoes = ' + str(shoes) + ' of ' + str(cards_per_shoe) + ' cards')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,255 @@
+"""
+sidebets.py
+
+Variance-reduced estimates of what the Perfect Pair and 21+3 side bets win
+"""
+
+import collections
+import sys
+
+import numpy as np
+
+import blackjack
+import blackjack_batch
+import runner
+import stats
+
+# A side bet's pnl per shoe, with the side bet placed (one NORMAL_BET_AMOUNT)
+# whenever get_bet_amount() places the main bet and the pre-deal yield
+# clears the bet's EV threshold. Three estimates come from the same rounds:
+#
+# plain       what the deals in the shoe actually paid
+# control     plain minus beta times (actual pay - exact pre-deal EV). The
+#             exact EV is the payout's expectation given what's left in the
+#             shoe, so the control has mean 0 and the estimate stays unbiased
+#             (beta = 1 is the exact EV alone; beta is fitted across shoes)
+# importance  every round also deals virtual hands from a proposal that
+#             favours the rare categories, each weighted by
+#             P(hand) / Q(hand) so its expectation is unchanged
+#
+# The shoes are played by the batch engine, which settles the side bets as
+# part of each round's outcome. Side bets don't change which cards are
+# dealt, so here they're scored again from the same rounds.
+
+PP = 'pp'
+PLUS3 = 'plus3'
+HAND_SIZES = {PP: 2, PLUS3: 3}
+# Proposal mixtures for importance sampling: the chance of dealing a hand
+# from each rare group instead of the whole shoe
+PP_MIX = {'rank': 0.5}
+PLUS3_MIX = {'rank': 0.25, 'suit': 0.35}
+SHOES_PER_CHUNK = 500  # Shoes whose card counts are held in memory at once
+
+CARD_RANKS = np.arange(52) % 13
+CARD_SUITS = np.arange(52) // 13
+CARD_BLACK = (CARD_SUITS == 0) | (CARD_SUITS == 3)  # s and c, as in evaluate_pp()
+
+SideBetEstimates = collections.namedtuple('SideBetEstimates', ['plain', 'control', 'importance', 'beta', 'rounds'])
+
+def choose(n, k):
+    result = np.ones_like(n, dtype=np.float64)
+    for i in range(0,k):
+        result *= (n - i) / (i + 1.0)
+    return np.maximum(result, 0.0)
+
+def get_pp_yields(compositions):
+    # blackjack.get_pp_ev_from_composition() for each (m, 52) composition, in
+    # integers so the threshold test matches get_bet_amount() exactly
+    by_suit = compositions.reshape(-1, 4, 13).astype(np.int64)
+    s, h, d, c = by_suit[:, 0], by_suit[:, 1], by_suit[:, 2], by_suit[:, 3]
+    perfect_pairs = blackjack.choose_2(by_suit).sum(axis=(1, 2))
+    colored_pairs = (s * c + h * d).sum(axis=1)
+    mixed_pairs = ((s + c) * (h + d)).sum(axis=1)
+    return blackjack.get_pp_yield(perfect_pairs, colored_pairs, mixed_pairs, by_suit.sum(axis=(1, 2)))
+
+def get_plus3_yields(compositions):
+    # blackjack.get_plus3_ev_from_composition(), like get_pp_yields()
+    by_suit = compositions.reshape(-1, 4, 13).astype(np.int64)
+    rank_totals = by_suit.sum(axis=1)
+    suited_trips = blackjack.choose_3(by_suit).sum(axis=(1, 2))
+    rank_trips = blackjack.choose_3(rank_totals).sum(axis=1)
+    straights = 0
+    straight_flushes = 0
+    for low, mid, high in blackjack.STRAIGHT_WINDOWS:
+        straights = straights + rank_totals[:, low] * rank_totals[:, mid] * rank_totals[:, high]
+        straight_flushes = straight_flushes + (by_suit[:, :, low] * by_suit[:, :, mid] * by_suit[:, :, high]).sum(axis=1)
+    suited_triples = blackjack.choose_3(by_suit.sum(axis=2)).sum(axis=1)
+    return blackjack.get_plus3_yield(suited_trips, rank_trips, straights, straight_flushes, suited_triples,
+                                     by_suit.sum(axis=(1, 2)))
+
+def get_pp_evs(compositions):
+    # Exact Perfect Pair EV per unit for each (m, 52) composition
+    return get_pp_yields(compositions) / choose(compositions.sum(axis=1), 2)
+
+def get_plus3_evs(compositions):
+    # Exact 21+3 EV per unit, like get_pp_evs()
+    return get_plus3_yields(compositions) / choose(compositions.sum(axis=1), 3)
+
+def get_pp_payouts(hands):
+    # evaluate_pp() for an (m, 2) array of card codes
+    first, second = hands[:, 0], hands[:, 1]
+    same_rank = CARD_RANKS[first] == CARD_RANKS[second]
+    same_color = CARD_BLACK[first] == CARD_BLACK[second]
+    return np.where(same_rank, np.where(first == second, 25, np.where(same_color, 12, 6)), -1)
+
+def get_plus3_payouts(hands):
+    # evaluate_plus3() for an (m, 3) array of card codes
+    ranks = np.sort(CARD_RANKS[hands], axis=1)
+    suits = CARD_SUITS[hands]
+    trips = (ranks[:, 0] == ranks[:, 2])
+    flush = (suits[:, 0] == suits[:, 1]) & (suits[:, 1] == suits[:, 2])
+    distinct = (ranks[:, 0] < ranks[:, 1]) & (ranks[:, 1] < ranks[:, 2])
+    straight = distinct & ((ranks[:, 2] - ranks[:, 0] == 2) | ((ranks[:, 0] == 0) & (ranks[:, 1] == 11)))  # QKA
+    return np.select([trips & flush, trips, straight & flush, straight, flush], [100, 25, 40, 10, 5], -1)
+
+GET_YIELDS = {PP: get_pp_yields, PLUS3: get_plus3_yields}
+GET_EVS = {PP: get_pp_evs, PLUS3: get_plus3_evs}
+GET_PAYOUTS = {PP: get_pp_payouts, PLUS3: get_plus3_payouts}
+
+def get_groups(compositions, group):
+    # (m, groups, cards in a group) counts, and the code of each slot: ranks
+    # are 13 groups of 4 suits, suits 4 groups of 13 ranks
+    by_suit = compositions.reshape(-1, 4, 13)
+    if group == 'rank':
+        return by_suit.transpose(0, 2, 1), np.arange(52).reshape(4, 13).T
+    return by_suit, np.arange(52).reshape(4, 13)
+
+def deal_from_groups(rng, counts, codes, k):
+    # A k-card hand per row, uniform over the hands whose cards all share one
+    # group: a group with chance C(its cards, k) / total, then k of its cards
+    m = len(counts)
+    totals = counts.sum(axis=2)
+    weights = choose(totals, k)
+    cumulative = np.cumsum(weights, axis=1)
+    groups = (rng.random(m)[:, None] * cumulative[:, -1:] >= cumulative).sum(axis=1)
+    group_counts = counts[np.arange(m), groups]
+    # k distinct positions among the group's cards, then the card at each
+    keys = rng.random((m, int(totals.max())))
+    keys[np.arange(keys.shape[1]) >= totals[np.arange(m), groups][:, None]] = np.inf
+    positions = np.argpartition(keys, k - 1, axis=1)[:, :k]
+    slots = (positions[:, :, None] >= np.cumsum(group_counts, axis=1)[:, None, :]).sum(axis=2)
+    return codes[groups[:, None], slots]
+
+def deal_importance_hands(rng, compositions, side_bet, mix=None):
+    # One virtual hand per composition from the proposal mixture, and its
+    # weight P(hand) / Q(hand)
+    if mix is None:
+        mix = PP_MIX if side_bet == PP else PLUS3_MIX
+    k = HAND_SIZES[side_bet]
+    m = len(compositions)
+    cards = compositions.sum(axis=1)
+    # The whole shoe: k distinct positions, then the card at each
+    keys = rng.random((m, int(cards.max())))
+    keys[np.arange(keys.shape[1]) >= cards[:, None]] = np.inf
+    positions = np.argpartition(keys, k - 1, axis=1)[:, :k]
+    hands = (positions[:, :, None] >= np.cumsum(compositions, axis=1)[:, None, :]).sum(axis=2)
+    pick = rng.random(m)
+    chance = 0.0
+    group_hands = {}
+    for group, share in mix.items():
+        counts, codes = get_groups(compositions, group)
+        group_hands[group] = choose(counts.sum(axis=2), k).sum(axis=1)
+        dealt = (pick >= chance) & (pick < chance + share) & (group_hands[group] > 0)
+        if dealt.any():
+            hands[dealt] = deal_from_groups(rng, counts[dealt], codes, k)
+        chance += share
+    # Q(hand) = (1 - sum of shares) P(hand) + each share / hands in its group
+    # when the hand is in that group
+    p = 1.0 / choose(cards, k)
+    q = (1.0 - chance) * p
+    for group, share in mix.items():
+        key = CARD_RANKS if group == 'rank' else CARD_SUITS
+        in_group = (key[hands] == key[hands[:, :1]]).all(axis=1) & (group_hands[group] > 0)
+        q = q + np.where(in_group, share / np.maximum(group_hands[group], 1.0), 0.0)
+        q = q + np.where(group_hands[group] > 0, 0.0, share * p)  # A group with no hands deals from the whole shoe
+    return hands, p / q
+
+def get_rounds(shoes, config):
+    # For every round played: its shoe, the composition before the deal, our
+    # two cards and the dealer's up card, and whether get_bet_amount() places
+    # a main bet
+    decks = shoes.shape[1] // 52
+    n_cards = shoes.shape[1]
+    seen = np.zeros((len(shoes), n_cards + 1, 52), dtype=np.int16)
+    np.cumsum(np.eye(52, dtype=np.int16)[shoes], axis=1, out=seen[:, 1:])
+    running_counts = blackjack_batch.get_system_counts(shoes, [config.card_counting_system])[:, :, 0]
+    ours = 2 * config.number_of_other_players + np.arange(3)  # Each seat's 2 cards, then the dealer's up card
+    # Only the rounds are needed here, not what the engine's side bets won
+    no_side_bets = config._replace(count_the_pp_side_bet=False, count_the_plus3_side_bet=False)
+    for rows, pos, outcome in blackjack_batch.play_passes(shoes, no_side_bets):
+        compositions = decks - seen[rows, pos]
+        if config.bet_only_when_favorable_count:
+            betting = blackjack.is_favorable_count(running_counts[rows, pos], n_cards - pos, config)
+        else:
+            betting = np.ones(len(rows), dtype=bool)
+        yield rows, compositions, shoes[rows[:, None], pos[:, None] + ours], betting
+
+def estimate_shoes(shoes, side_bet, config=None, seed=None, mix=None):
+    # Per-shoe pnl arrays for the plain, control and importance estimates of
+    # side_bet (PP or PLUS3) on shoes, an (n_shoes, cards) array of card codes
+    if config is None:
+        config = blackjack.get_config()
+    rng = np.random.default_rng(runner.get_master_seed(seed))
+    k = HAND_SIZES[side_bet]
+    threshold = config.pp_ev_threshold if side_bet == PP else config.plus3_ev_threshold
+    bet_amt = float(config.normal_bet_amount)
+    plain = np.zeros(len(shoes))
+    exact = np.zeros(len(shoes))
+    importance = np.zeros(len(shoes))
+    rounds = 0
+    for start in range(0, len(shoes), SHOES_PER_CHUNK):
+        chunk = shoes[start:start + SHOES_PER_CHUNK]
+        for rows, compositions, dealt, betting in get_rounds(chunk, config):
+            # get_bet_amount() tests the yield, which has the EV's sign
+            placed = betting & (GET_YIELDS[side_bet](compositions) > threshold)
+            if not placed.any():
+                continue
+            rows, compositions = rows[placed] + start, compositions[placed]
+            evs = GET_EVS[side_bet](compositions)
+            np.add.at(plain, rows, bet_amt * GET_PAYOUTS[side_bet](dealt[placed][:, :k]))
+            np.add.at(exact, rows, bet_amt * evs)
+            hands, weights = deal_importance_hands(rng, compositions, side_bet, mix)
+            np.add.at(importance, rows, bet_amt * weights * GET_PAYOUTS[side_bet](hands))
+            rounds += len(rows)
+    # beta minimising the variance of plain - beta * (plain - exact)
+    control = plain - exact
+    beta = float(np.dot(plain - plain.mean(), control - control.mean()) / max(np.dot(control - control.mean(), control - control.mean()), 1e-300))
+    return SideBetEstimates(plain, plain - beta * control, importance, beta, rounds)
+
+def get_stats(values):
+    value_stats = stats.RunningStats()
+    for value in values.tolist():
+        value_stats.add(value)
+    return value_stats
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Estimate side-bet pnl with control variates and importance sampling')
+    parser.add_argument('--side-bet', choices=[PP, PLUS3], default=PP)
+    parser.add_argument('--shoes', type=int, default=2000, help='shoes to play with the batch engine')
+    parser.add_argument('--seed', type=int, help='master seed for the shoes and the virtual hands')
+    parser.add_argument('--every-round', action='store_true',
+                        help='place the side bet every round instead of by count and EV threshold')
+    args = parser.parse_args(argv)
+
+    seed = runner.get_master_seed(args.seed)
+    config = blackjack.get_config()
+    if args.every_round:
+        config = config._replace(bet_only_when_favorable_count=False, pp_ev_threshold=-np.inf, plus3_ev_threshold=-np.inf)
+    shoes = runner.shuffle_shoes(blackjack.fill_shoe(config.decks_per_shoe).cards, args.shoes, seed)
+    estimates = estimate_shoes(shoes, args.side_bet, config, seed)
+    print('Seed = ' + str(seed))
+    print('Side bets placed = ' + str(estimates.rounds) + ' over ' + str(args.shoes) + ' shoes')
+    plain_variance = get_stats(estimates.plain).variance()
+    for name in ('plain', 'control', 'importance'):
+        estimate_stats = get_stats(getattr(estimates, name))
+        line = (name + ' EV per shoe = ' + str(round(estimate_stats.mean, 3)) + ' +/- ' +
+                str(round(estimate_stats.half_width(), 3)) + ' (95%)')
+        if name != 'plain' and estimate_stats.variance() > 0.0:
+            line += ', ' + str(round(plain_variance / estimate_stats.variance(), 1)) + 'x fewer shoes than plain'
+        print(line)
+    print('beta = ' + str(round(estimates.beta, 3)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""
+stats.py
+
+Running statistics over per-shoe results, in constant memory
+"""
+
+import math
+
+class RunningStats:
+    # Welford's online mean and variance. Accumulators filled by different
+    # workers combine with merge(), which gives the same result as adding
+    # every sample to one accumulator.
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # Sum of squared differences from the mean
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def merge(self, other):
+        # Chan et al.'s pairwise update
+        n = self.n + other.n
+        if n == 0:
+            return self
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+        return self
+
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    def stdev(self):
+        return math.sqrt(self.variance())
+
+    def standard_error(self):
+        return math.sqrt(self.variance() / self.n) if self.n > 1 else math.inf
+
+    def half_width(self, z=1.96):
+        # Half the width of the mean's confidence interval, 95% by default
+        return z * self.standard_error()
+
+    def risk_of_ruin(self, bankroll):
+        # Chance of ever losing bankroll, by the diffusion approximation
+        # exp(-2 * mean * bankroll / variance). 1 when the game has no edge.
+        if self.mean <= 0.0:
+            return 1.0
+        return math.exp(-2.0 * self.mean * bankroll / self.variance()) if self.variance() > 0.0 else 0.0
+
+    def n0(self):
+        # Samples until the expected result equals one standard deviation,
+        # variance / mean^2. Smaller is a better game to be playing.
+        return self.variance() / (self.mean * self.mean) if self.mean != 0.0 else math.inf
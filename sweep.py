@@ -0,0 +1,148 @@
+"""
+sweep.py
+
+Plays a grid of blackjack configs across one pool of worker processes,
+caching each config's results on disk
+"""
+
+import ast
+import concurrent.futures
+import functools
+import hashlib
+import itertools
+import json
+import os
+import sys
+
+import blackjack
+import runner
+import stats
+
+CACHE_DIRECTORY = '.sweep_cache'
+CODE_FILES = ['blackjack.py', 'runner.py', 'stats.py']  # Results are only reused while these are unchanged
+
+def get_code_version():
+    # Hash of the source a result was played with
+    code_hash = hashlib.sha256()
+    for name in CODE_FILES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), 'rb') as source:
+            code_hash.update(source.read())
+    return code_hash.hexdigest()[:16]
+
+def expand_grid(grid, base=None):
+    # Every combination of the values in grid, a dict of Config field names to
+    # lists of values, laid over base (default blackjack.get_config())
+    if base is None:
+        base = blackjack.get_config()
+    names = list(grid)
+    return [base._replace(**dict(zip(names, values))) for values in itertools.product(*[grid[name] for name in names])]
+
+def get_cache_key(config, shoes, seed, code_version):
+    key = json.dumps([list(config), shoes, seed, code_version])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def get_cache_path(key, cache_directory=CACHE_DIRECTORY):
+    return os.path.join(cache_directory, key + '.json')
+
+def load_result(key, cache_directory=CACHE_DIRECTORY):
+    try:
+        with open(get_cache_path(key, cache_directory)) as cached:
+            result = json.load(cached)
+    except (OSError, ValueError):
+        return None
+    shoe_stats = stats.RunningStats()
+    shoe_stats.n, shoe_stats.mean, shoe_stats.m2 = result['n'], result['mean'], result['m2']
+    return shoe_stats
+
+def save_result(key, config, shoes, seed, code_version, shoe_stats, cache_directory=CACHE_DIRECTORY):
+    # Written to a temporary file and renamed, so an interrupted sweep never
+    # leaves a half-written result behind
+    os.makedirs(cache_directory, exist_ok=True)
+    path = get_cache_path(key, cache_directory)
+    result = {'config': config._asdict(), 'shoes': shoes, 'seed': seed, 'code_version': code_version,
+              'n': shoe_stats.n, 'mean': shoe_stats.mean, 'm2': shoe_stats.m2}
+    with open(path + '.tmp', 'w') as cached:
+        json.dump(result, cached)
+    os.replace(path + '.tmp', path)
+
+def run_sweep(configs, shoes, seed, workers=None, chunk_size=None, cache_directory=CACHE_DIRECTORY):
+    # Returns a stats.RunningStats per config, in order. Every config plays the
+    # same shoes of seed (common random numbers), so differences between them
+    # aren't shuffle noise. Cached configs are read back; the chunks of every
+    # other config go to one pool together, so small configs don't leave
+    # workers idle. A seed of None draws one fresh master seed for the whole
+    # sweep.
+    seed = runner.get_master_seed(seed)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(1, -(-shoes // (workers * 4)))
+    code_version = get_code_version()
+    keys = [get_cache_key(config, shoes, seed, code_version) for config in configs]
+    results = [load_result(key, cache_directory) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if not missing:
+        return results
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        chunks = {}
+        for i in missing:
+            play_shoe = functools.partial(blackjack.play, config=configs[i])
+            for first_shoe in range(0, shoes, chunk_size):
+                args = (runner.stats_chunk, play_shoe, first_shoe, min(chunk_size, shoes - first_shoe), seed)
+                chunks.setdefault(i, []).append(executor.submit(*args) if executor is not None else args[0](*args[1:]))
+        for i in missing:
+            results[i] = stats.RunningStats()
+            for chunk in chunks[i]:
+                results[i].merge(chunk.result() if executor is not None else chunk)
+            save_result(keys[i], configs[i], shoes, seed, code_version, results[i], cache_directory)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return results
+
+def parse_grid(items):
+    # ['penetration=0.5,0.75', 'strategy=S17,H17'] to a grid dict. Values are
+    # Python literals, or strings when they aren't one.
+    grid = {}
+    for item in items:
+        name, _, values = item.partition('=')
+        name = name.strip().lower()
+        if name not in blackjack.CONFIG_FIELDS:
+            raise ValueError('unknown config field ' + name)
+        grid[name] = []
+        for value in values.split(','):
+            try:
+                grid[name].append(ast.literal_eval(value.strip()))
+            except (ValueError, SyntaxError):
+                grid[name].append(value.strip())
+    return grid
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Play a grid of blackjack configs')
+    parser.add_argument('grid', nargs='+', metavar='FIELD=V1,V2', help='config field and the values to sweep it over')
+    parser.add_argument('--shoes', type=int, default=blackjack.SHOES_TO_PLAY, help='shoes per config')
+    parser.add_argument('--seed', type=int, default=0, help='master seed, the same for every config')
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per core)')
+    parser.add_argument('--chunk-size', type=int, help='shoes per worker task')
+    parser.add_argument('--cache', default=CACHE_DIRECTORY, help='directory results are cached in')
+    args = parser.parse_args(argv)
+    try:
+        grid = parse_grid(args.grid)
+    except ValueError as error:
+        parser.error(str(error))
+
+    configs = expand_grid(grid)
+    results = run_sweep(configs, args.shoes, args.seed, args.workers, args.chunk_size, args.cache)
+    names = list(grid)
+    print('\t'.join(names + ['EV per shoe', '+/- (95%)', 'SD', 'Risk of ruin', 'N0']))
+    for config, shoe_stats in zip(configs, results):
+        row = [str(getattr(config, name)) for name in names]
+        row += [str(round(shoe_stats.mean, 2)), str(round(shoe_stats.half_width(), 2)), str(round(shoe_stats.stdev(), 2)),
+                str(round(shoe_stats.risk_of_ruin(config.starting_bankroll), 4)), str(round(shoe_stats.n0(), 1))]
+        print('\t'.join(row))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,41 @@
+import itertools
+
+import pytest
+
+import baccarat
+import runner
+
+SEED = 11
+
+def test_play_shoe_table_matches_play_shoe():
+    for shoe in range(0, 200):
+        assert baccarat.play_shoe_table(rng=runner.get_shoe_rng(SEED, shoe)) == \
+            baccarat.play_shoe(rng=runner.get_shoe_rng(SEED, shoe))
+
+def test_outcome_table_matches_play_hand():
+    # Every key is six card values, most significant digit first; 0 is a ten
+    table = baccarat.get_outcome_table().tolist()
+    for key, digits in enumerate(itertools.product(range(0, 10), repeat=6)):
+        winner, used = baccarat.play_hand(digits, 0)
+        assert table[key] == (used << 2) | winner
+
+def test_exact_odds_match_brute_force():
+    # Every ordered draw of six cards from a small shoe is equally likely
+    composition = [3, 1, 0, 2, 0, 1, 0, 0, 1, 2]
+    cards = [value for value, n in enumerate(composition) for x in range(0, n)]
+    wins = [0, 0, 0]
+    draws = 0
+    for window in itertools.permutations(cards, 6):
+        winner, used = baccarat.play_hand(window, 0)
+        wins[winner] += 1
+        draws += 1
+    player, banker, tie = baccarat.get_exact_odds(composition)
+    assert abs(player - wins[baccarat.PLAYER_WIN] / draws) < 1e-12
+    assert abs(banker - wins[baccarat.BANKER_WIN] / draws) < 1e-12
+    assert abs(tie - wins[baccarat.TIE] / draws) < 1e-12
+
+def test_simulate_rejects_short_cut_card():
+    for engine in ('scalar', 'table', 'batch'):
+        with pytest.raises(ValueError):
+            baccarat.simulate(2, cut_card=3, seed=SEED, engine=engine)
+    assert baccarat.simulate(2, cut_card=5, seed=SEED, engine='batch').hands > 0
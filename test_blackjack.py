@@ -0,0 +1,53 @@
+import itertools
+
+import blackjack
+import blackjack_batch
+import runner
+
+SEED = 7
+
+def get_shoe(decks):
+    shoe = blackjack.fill_shoe(decks)
+    shoe.shuffle(runner.get_shoe_rng(SEED, 0))
+    return shoe
+
+def brute_force_pp(shoe):
+    return sum(blackjack.evaluate_pp(hand) for hand in itertools.combinations(list(shoe), 2))
+
+def brute_force_plus3(shoe):
+    return sum(blackjack.evaluate_plus3(hand) for hand in itertools.combinations(list(shoe), 3))
+
+def test_side_bet_tracker_matches_composition_ev():
+    # Every card is counted as it's drawn, so the tracker should agree with a
+    # fresh count of what's left after each one
+    shoe = get_shoe(2)
+    tracker = blackjack.SideBetTracker(shoe)
+    count = 0.0
+    while len(shoe) > 2:
+        count = blackjack.count_this_card(blackjack.get_card(shoe), count, tracker)
+        assert tracker.pp_ev() == blackjack.get_pp_ev(shoe)
+        assert tracker.plus3_ev() == blackjack.get_plus3_ev(shoe)
+
+def test_side_bet_ev_matches_brute_force():
+    # One deck dealt down, checked against every 2- and 3-card combination
+    shoe = get_shoe(1)
+    tracker = blackjack.SideBetTracker(shoe)
+    count = 0.0
+    while len(shoe) > 2:
+        if len(shoe) % 10 == 2:
+            assert blackjack.get_pp_ev(shoe) == tracker.pp_ev() == brute_force_pp(shoe)
+            assert blackjack.get_plus3_ev(shoe) == tracker.plus3_ev() == brute_force_plus3(shoe)
+        count = blackjack.count_this_card(blackjack.get_card(shoe), count, tracker)
+
+def test_batch_engine_matches_play():
+    # Every round is bet so splits, resplits and the rounds replayed through
+    # the scalar engine all come up. Side bets are placed every round too.
+    shoes = runner.shuffle_shoes(blackjack.fill_shoe(8).cards, 100, SEED)
+    for strategy in ('S17', 'H17'):
+        for other_players in (0, 5):
+            config = blackjack.get_config(strategy=strategy, number_of_other_players=other_players,
+                                          bet_only_when_favorable_count=False, count_the_plus3_side_bet=True,
+                                          pp_ev_threshold=float('-inf'), plus3_ev_threshold=float('-inf'))
+            pnls = blackjack_batch.play_shuffled_shoes(shoes, config).tolist()
+            for shoe, pnl in zip(shoes, pnls):
+                assert blackjack.play(config=config, cards=shoe) == pnl
@@ -0,0 +1,37 @@
+import pytest
+
+import blackjack
+import eventlog
+import runner
+
+SEED = 3
+
+def write_log(path, shoes=3):
+    config = blackjack.get_config(bet_only_when_favorable_count=False, count_the_pp_side_bet=False)
+    with eventlog.RoundRecorder(path, buffer_rounds=16) as recorder:
+        for shoe in range(0, shoes):
+            blackjack.play(runner.get_shoe_rng(SEED, shoe), recorder, config)
+
+def test_export_parquet_round_trips(tmp_path):
+    pyarrow_parquet = pytest.importorskip('pyarrow.parquet')
+    log_path = str(tmp_path / 'rounds.log')
+    parquet_path = str(tmp_path / 'rounds.parquet')
+    write_log(log_path)
+    rounds = eventlog.read_rounds(log_path)
+    eventlog.export_parquet(log_path, parquet_path, rows_per_group=50)
+    parquet = pyarrow_parquet.ParquetFile(parquet_path)
+    assert parquet.metadata.num_row_groups == -(-len(rounds) // 50)
+    table = parquet.read()
+    assert table.column_names == [name for name, code in eventlog.RECORD_FIELDS]
+    for name in table.column_names:
+        assert table.column(name).to_numpy().tolist() == rounds[name].tolist()
+
+def test_export_parquet_empty_log(tmp_path):
+    pyarrow_parquet = pytest.importorskip('pyarrow.parquet')
+    log_path = str(tmp_path / 'rounds.log')
+    parquet_path = str(tmp_path / 'rounds.parquet')
+    eventlog.RoundRecorder(log_path).close()
+    eventlog.export_parquet(log_path, parquet_path)
+    table = pyarrow_parquet.read_table(parquet_path)
+    assert table.num_rows == 0
+    assert table.column_names == [name for name, code in eventlog.RECORD_FIELDS]